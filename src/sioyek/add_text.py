@@ -32,20 +32,23 @@ def parse_params(ps):
 
     return res
 
-if __name__ == '__main__':
+def main(argv, sioyek_factory=Sioyek):
 
-    SIOYEK_PATH = clean_path(sys.argv[1])
-    LOCAL_DATABASE_PATH = clean_path(sys.argv[2])
-    SHARED_DATABASE_PATH = clean_path(sys.argv[3])
-    FILE_PATH = clean_path(sys.argv[4])
-    rect_string = sys.argv[5]
-    added_text = sys.argv[6]
+    SIOYEK_PATH = clean_path(argv[1])
+    LOCAL_DATABASE_PATH = clean_path(argv[2])
+    SHARED_DATABASE_PATH = clean_path(argv[3])
+    FILE_PATH = clean_path(argv[4])
+    rect_string = argv[5]
+    added_text = argv[6]
 
-    params = parse_params(sys.argv[7:])
+    params = parse_params(argv[7:])
 
-    sioyek = Sioyek(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH)
+    sioyek = sioyek_factory(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH, read_only_databases=True)
     document = sioyek.get_document(FILE_PATH)
     selected_page, selected_rect = parse_rect(rect_string)
 
     document.embed_text_in_pdf(added_text, selected_page, selected_rect, params)
     sioyek.reload()
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,509 @@
+'''
+An asyncio version of the `Sioyek` command interface which doesn't depend on PyQt5, for example:
+
+    async def main():
+        async with AsyncSioyek(sioyek_path) as sioyek:
+            await sioyek.set_status_string('downloading ...')
+
+It speaks the same length-prefixed `QDataStream` protocol that sioyek's local server expects over an
+asyncio unix domain stream. On Windows, where sioyek's local server is a named pipe, the commands are
+executed by running the sioyek binary in a subprocess instead.
+'''
+
+import os
+import sys
+import struct
+import asyncio
+
+SIOYEK_SERVER_NAME = 'sioyek'
+CONNECT_TIMEOUT_SECONDS = 1
+
+def get_command_params(sioyek_path, command_name, text=None, focus=False):
+    if text == None:
+        params = [sioyek_path, '--execute-command', command_name]
+    else:
+        params = [sioyek_path, '--execute-command', command_name, '--execute-command-data', str(text)]
+
+    if focus == False:
+        params.append('--nofocus')
+    return params
+
+def serialize_qstring(string):
+    # QDataStream serializes QStrings as the byte length followed by UTF-16 (big endian) data
+    data = string.encode('utf-16-be')
+    return struct.pack('>I', len(data)) + data
+
+def serialize_command_params(params):
+    '''
+    Same as `sioyek.serialize_command_params` without using Qt.
+    '''
+    return struct.pack('>i', len(params)) + b''.join(serialize_qstring(param) for param in params)
+
+def get_local_server_path(server_name=SIOYEK_SERVER_NAME):
+    # this is where QLocalServer puts its socket file on unix
+    temp_dir = os.environ.get('TMPDIR', '/tmp')
+    return os.path.join(temp_dir, server_name)
+
+class AsyncSioyek:
+
+    def __init__(self, sioyek_path, force_binary=False):
+        self.path = sioyek_path
+        self.is_dummy_mode = False
+        # local sockets are not available on windows, so we always use the binary there
+        self.force_binary = force_binary or (sys.platform == 'win32')
+        self.connected = False
+        self.reader = None
+        self.writer = None
+        self.write_lock = None
+
+    async def connect(self):
+        if self.force_binary:
+            return False
+
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(get_local_server_path()),
+                CONNECT_TIMEOUT_SECONDS)
+            self.write_lock = asyncio.Lock()
+            self.connected = True
+        except (OSError, asyncio.TimeoutError):
+            self.connected = False
+        return self.connected
+
+    async def close(self):
+        if self.writer != None:
+            self.writer.close()
+            await self.writer.wait_closed()
+        self.reader = None
+        self.writer = None
+        self.connected = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    def set_dummy_mode(self, mode):
+        '''
+        dummy mode prints commands instead of executing them on sioyek
+        '''
+        self.is_dummy_mode = mode
+
+    def should_use_local_socket(self):
+        return (not self.force_binary) and (self.connected)
+
+    async def run_command(self, command_name, text=None, focus=False):
+        params = get_command_params(self.path, command_name, text, focus)
+
+        if self.is_dummy_mode:
+            print('dummy mode, executing: ', params)
+            return
+
+        if (not self.force_binary) and (self.writer == None):
+            await self.connect()
+
+        if self.should_use_local_socket():
+            async with self.write_lock:
+                self.writer.write(serialize_command_params(params))
+                await self.writer.drain()
+        else:
+            process = await asyncio.create_subprocess_exec(*params)
+            await process.wait()
+
+    async def goto_begining(self, focus=False):
+        await self.run_command("goto_begining", None, focus=focus)
+
+    async def goto_end(self, focus=False):
+        await self.run_command("goto_end", None, focus=focus)
+
+    async def goto_definition(self, focus=False):
+        await self.run_command("goto_definition", None, focus=focus)
+
+    async def overview_definition(self, focus=False):
+        await self.run_command("overview_definition", None, focus=focus)
+
+    async def portal_to_definition(self, focus=False):
+        await self.run_command("portal_to_definition", None, focus=focus)
+
+    async def next_item(self, focus=False):
+        await self.run_command("next_item", None, focus=focus)
+
+    async def previous_item(self, focus=False):
+        await self.run_command("previous_item", None, focus=focus)
+
+    async def set_mark(self, symbol, focus=False):
+        await self.run_command("set_mark", symbol, focus=focus)
+
+    async def goto_mark(self, symbol, focus=False):
+        await self.run_command("goto_mark", symbol, focus=focus)
+
+    async def goto_page_with_page_number(self, text, focus=False):
+        await self.run_command("goto_page_with_page_number", text, focus=focus)
+
+    async def search(self, text, focus=False):
+        await self.run_command("search", text, focus=focus)
+
+    async def ranged_search(self, text, focus=False):
+        await self.run_command("ranged_search", text, focus=focus)
+
+    async def chapter_search(self, text, focus=False):
+        await self.run_command("chapter_search", text, focus=focus)
+
+    async def move_down(self, focus=False):
+        await self.run_command("move_down", None, focus=focus)
+
+    async def move_up(self, focus=False):
+        await self.run_command("move_up", None, focus=focus)
+
+    async def move_left(self, focus=False):
+        await self.run_command("move_left", None, focus=focus)
+
+    async def move_right(self, focus=False):
+        await self.run_command("move_right", None, focus=focus)
+
+    async def zoom_in(self, focus=False):
+        await self.run_command("zoom_in", None, focus=focus)
+
+    async def zoom_out(self, focus=False):
+        await self.run_command("zoom_out", None, focus=focus)
+
+    async def fit_to_page_width(self, focus=False):
+        await self.run_command("fit_to_page_width", None, focus=focus)
+
+    async def fit_to_page_height(self, focus=False):
+        await self.run_command("fit_to_page_height", None, focus=focus)
+
+    async def fit_to_page_height_smart(self, focus=False):
+        await self.run_command("fit_to_page_height_smart", None, focus=focus)
+
+    async def fit_to_page_width_smart(self, focus=False):
+        await self.run_command("fit_to_page_width_smart", None, focus=focus)
+
+    async def next_page(self, focus=False):
+        await self.run_command("next_page", None, focus=focus)
+
+    async def previous_page(self, focus=False):
+        await self.run_command("previous_page", None, focus=focus)
+
+    async def open_document(self, filename, focus=False):
+        await self.run_command("open_document", filename, focus=focus)
+
+    async def debug(self, focus=False):
+        await self.run_command("debug", None, focus=focus)
+
+    async def add_bookmark(self, text, focus=False):
+        await self.run_command("add_bookmark", text, focus=focus)
+
+    async def add_highlight(self, symbol, focus=False):
+        await self.run_command("add_highlight", symbol, focus=focus)
+
+    async def goto_toc(self, focus=False):
+        await self.run_command("goto_toc", None, focus=focus)
+
+    async def goto_highlight(self, focus=False):
+        await self.run_command("goto_highlight", None, focus=focus)
+
+    async def goto_bookmark(self, focus=False):
+        await self.run_command("goto_bookmark", None, focus=focus)
+
+    async def goto_bookmark_g(self, focus=False):
+        await self.run_command("goto_bookmark_g", None, focus=focus)
+
+    async def goto_highlight_g(self, focus=False):
+        await self.run_command("goto_highlight_g", None, focus=focus)
+
+    async def goto_highlight_ranged(self, focus=False):
+        await self.run_command("goto_highlight_ranged", None, focus=focus)
+
+    async def link(self, focus=False):
+        await self.run_command("link", None, focus=focus)
+
+    async def portal(self, focus=False):
+        await self.run_command("portal", None, focus=focus)
+
+    async def next_state(self, focus=False):
+        await self.run_command("next_state", None, focus=focus)
+
+    async def prev_state(self, focus=False):
+        await self.run_command("prev_state", None, focus=focus)
+
+    async def pop_state(self, focus=False):
+        await self.run_command("pop_state", None, focus=focus)
+
+    async def test_command(self, focus=False):
+        await self.run_command("test_command", None, focus=focus)
+
+    async def delete_link(self, focus=False):
+        await self.run_command("delete_link", None, focus=focus)
+
+    async def delete_portal(self, focus=False):
+        await self.run_command("delete_portal", None, focus=focus)
+
+    async def delete_bookmark(self, focus=False):
+        await self.run_command("delete_bookmark", None, focus=focus)
+
+    async def delete_highlight(self, focus=False):
+        await self.run_command("delete_highlight", None, focus=focus)
+
+    async def goto_link(self, focus=False):
+        await self.run_command("goto_link", None, focus=focus)
+
+    async def goto_portal(self, focus=False):
+        await self.run_command("goto_portal", None, focus=focus)
+
+    async def edit_link(self, focus=False):
+        await self.run_command("edit_link", None, focus=focus)
+
+    async def edit_portal(self, focus=False):
+        await self.run_command("edit_portal", None, focus=focus)
+
+    async def open_prev_doc(self, focus=False):
+        await self.run_command("open_prev_doc", None, focus=focus)
+
+    async def open_document_embedded(self, focus=False):
+        await self.run_command("open_document_embedded", None, focus=focus)
+
+    async def open_document_embedded_from_current_path(self, focus=False):
+        await self.run_command("open_document_embedded_from_current_path", None, focus=focus)
+
+    async def copy(self, focus=False):
+        await self.run_command("copy", None, focus=focus)
+
+    async def toggle_fullscreen(self, focus=False):
+        await self.run_command("toggle_fullscreen", None, focus=focus)
+
+    async def toggle_one_window(self, focus=False):
+        await self.run_command("toggle_one_window", None, focus=focus)
+
+    async def toggle_highlight(self, focus=False):
+        await self.run_command("toggle_highlight", None, focus=focus)
+
+    async def toggle_synctex(self, focus=False):
+        await self.run_command("toggle_synctex", None, focus=focus)
+
+    async def command(self, focus=False):
+        await self.run_command("command", None, focus=focus)
+
+    async def external_search(self, symbol, focus=False):
+        await self.run_command("external_search", symbol, focus=focus)
+
+    async def open_selected_url(self, focus=False):
+        await self.run_command("open_selected_url", None, focus=focus)
+
+    async def screen_down(self, focus=False):
+        await self.run_command("screen_down", None, focus=focus)
+
+    async def screen_up(self, focus=False):
+        await self.run_command("screen_up", None, focus=focus)
+
+    async def next_chapter(self, focus=False):
+        await self.run_command("next_chapter", None, focus=focus)
+
+    async def prev_chapter(self, focus=False):
+        await self.run_command("prev_chapter", None, focus=focus)
+
+    async def toggle_dark_mode(self, focus=False):
+        await self.run_command("toggle_dark_mode", None, focus=focus)
+
+    async def toggle_presentation_mode(self, focus=False):
+        await self.run_command("toggle_presentation_mode", None, focus=focus)
+
+    async def toggle_mouse_drag_mode(self, focus=False):
+        await self.run_command("toggle_mouse_drag_mode", None, focus=focus)
+
+    async def close_window(self, focus=False):
+        await self.run_command("close_window", None, focus=focus)
+
+    async def quit(self, focus=False):
+        await self.run_command("quit", None, focus=focus)
+
+    async def open_link(self, text, focus=False):
+        await self.run_command("open_link", text, focus=focus)
+
+    async def keyboard_select(self, text, focus=False):
+        await self.run_command("keyboard_select", text, focus=focus)
+
+    async def keyboard_smart_jump(self, text, focus=False):
+        await self.run_command("keyboard_smart_jump", text, focus=focus)
+
+    async def keyboard_overview(self, text, focus=False):
+        await self.run_command("keyboard_overview", text, focus=focus)
+
+    async def keys(self, focus=False):
+        await self.run_command("keys", None, focus=focus)
+
+    async def keys_user(self, focus=False):
+        await self.run_command("keys_user", None, focus=focus)
+
+    async def prefs(self, focus=False):
+        await self.run_command("prefs", None, focus=focus)
+
+    async def prefs_user(self, focus=False):
+        await self.run_command("prefs_user", None, focus=focus)
+
+    async def import_(self, focus=False):
+        await self.run_command("import", None, focus=focus)
+
+    async def export(self, focus=False):
+        await self.run_command("export", None, focus=focus)
+
+    async def enter_visual_mark_mode(self, focus=False):
+        await self.run_command("enter_visual_mark_mode", None, focus=focus)
+
+    async def move_visual_mark_down(self, focus=False):
+        await self.run_command("move_visual_mark_down", None, focus=focus)
+
+    async def move_visual_mark_up(self, focus=False):
+        await self.run_command("move_visual_mark_up", None, focus=focus)
+
+    async def set_page_offset(self, text, focus=False):
+        await self.run_command("set_page_offset", text, focus=focus)
+
+    async def toggle_visual_scroll(self, focus=False):
+        await self.run_command("toggle_visual_scroll", None, focus=focus)
+
+    async def toggle_horizontal_scroll_lock(self, focus=False):
+        await self.run_command("toggle_horizontal_scroll_lock", None, focus=focus)
+
+    async def toggle_custom_color(self, focus=False):
+        await self.run_command("toggle_custom_color", None, focus=focus)
+
+    async def execute(self, text, focus=False):
+        await self.run_command("execute", text, focus=focus)
+
+    async def execute_predefined_command(self, symbol, focus=False):
+        await self.run_command("execute_predefined_command", symbol, focus=focus)
+
+    async def embed_annotations(self, focus=False):
+        await self.run_command("embed_annotations", None, focus=focus)
+
+    async def copy_window_size_config(self, focus=False):
+        await self.run_command("copy_window_size_config", None, focus=focus)
+
+    async def toggle_select_highlight(self, focus=False):
+        await self.run_command("toggle_select_highlight", None, focus=focus)
+
+    async def set_select_highlight_type(self, symbol, focus=False):
+        await self.run_command("set_select_highlight_type", symbol, focus=focus)
+
+    async def open_last_document(self, focus=False):
+        await self.run_command("open_last_document", None, focus=focus)
+
+    async def toggle_window_configuration(self, focus=False):
+        await self.run_command("toggle_window_configuration", None, focus=focus)
+
+    async def prefs_user_all(self, focus=False):
+        await self.run_command("prefs_user_all", None, focus=focus)
+
+    async def keys_user_all(self, focus=False):
+        await self.run_command("keys_user_all", None, focus=focus)
+
+    async def fit_to_page_width_ratio(self, focus=False):
+        await self.run_command("fit_to_page_width_ratio", None, focus=focus)
+
+    async def smart_jump_under_cursor(self, focus=False):
+        await self.run_command("smart_jump_under_cursor", None, focus=focus)
+
+    async def overview_under_cursor(self, focus=False):
+        await self.run_command("overview_under_cursor", None, focus=focus)
+
+    async def close_overview(self, focus=False):
+        await self.run_command("close_overview", None, focus=focus)
+
+    async def visual_mark_under_cursor(self, focus=False):
+        await self.run_command("visual_mark_under_cursor", None, focus=focus)
+
+    async def close_visual_mark(self, focus=False):
+        await self.run_command("close_visual_mark", None, focus=focus)
+
+    async def zoom_in_cursor(self, focus=False):
+        await self.run_command("zoom_in_cursor", None, focus=focus)
+
+    async def zoom_out_cursor(self, focus=False):
+        await self.run_command("zoom_out_cursor", None, focus=focus)
+
+    async def goto_left(self, focus=False):
+        await self.run_command("goto_left", None, focus=focus)
+
+    async def goto_left_smart(self, focus=False):
+        await self.run_command("goto_left_smart", None, focus=focus)
+
+    async def goto_right(self, focus=False):
+        await self.run_command("goto_right", None, focus=focus)
+
+    async def goto_right_smart(self, focus=False):
+        await self.run_command("goto_right_smart", None, focus=focus)
+
+    async def rotate_clockwise(self, focus=False):
+        await self.run_command("rotate_clockwise", None, focus=focus)
+
+    async def rotate_counterclockwise(self, focus=False):
+        await self.run_command("rotate_counterclockwise", None, focus=focus)
+
+    async def goto_next_highlight(self, focus=False):
+        await self.run_command("goto_next_highlight", None, focus=focus)
+
+    async def goto_prev_highlight(self, focus=False):
+        await self.run_command("goto_prev_highlight", None, focus=focus)
+
+    async def goto_next_highlight_of_type(self, focus=False):
+        await self.run_command("goto_next_highlight_of_type", None, focus=focus)
+
+    async def goto_prev_highlight_of_type(self, focus=False):
+        await self.run_command("goto_prev_highlight_of_type", None, focus=focus)
+
+    async def add_highlight_with_current_type(self, focus=False):
+        await self.run_command("add_highlight_with_current_type", None, focus=focus)
+
+    async def enter_password(self, text, focus=False):
+        await self.run_command("enter_password", text, focus=focus)
+
+    async def toggle_fastread(self, focus=False):
+        await self.run_command("toggle_fastread", None, focus=focus)
+
+    async def goto_top_of_page(self, focus=False):
+        await self.run_command("goto_top_of_page", None, focus=focus)
+
+    async def goto_bottom_of_page(self, focus=False):
+        await self.run_command("goto_bottom_of_page", None, focus=focus)
+
+    async def new_window(self, focus=False):
+        await self.run_command("new_window", None, focus=focus)
+
+    async def toggle_statusbar(self, focus=False):
+        await self.run_command("toggle_statusbar", None, focus=focus)
+
+    async def reload(self, focus=False):
+        await self.run_command("reload", None, focus=focus)
+
+    async def synctex_under_cursor(self, focus=False):
+        await self.run_command("synctex_under_cursor", None, focus=focus)
+
+    async def set_status_string(self, text, focus=False):
+        await self.run_command("set_status_string", text, focus=focus)
+
+    async def focus_text(self, text, focus=False):
+        await self.run_command("focus_text", text, focus=focus)
+
+    async def clear_status_string(self, focus=False):
+        await self.run_command("clear_status_string", None, focus=focus)
+
+    async def toggle_titlebar(self, focus=False):
+        await self.run_command("toggle_titlebar", None, focus=focus)
+
+    async def next_preview(self, focus=False):
+        await self.run_command("next_preview", None, focus=focus)
+
+    async def previous_preview(self, focus=False):
+        await self.run_command("previous_preview", None, focus=focus)
+
+    async def goto_overview(self, focus=False):
+        await self.run_command("goto_overview", None, focus=focus)
+
+    async def portal_to_overview(self, focus=False):
+        await self.run_command("portal_to_overview", None, focus=focus)
+
+    async def goto_selected_text(self, focus=False):
+        await self.run_command("goto_selected_text", None, focus=focus)
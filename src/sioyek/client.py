@@ -0,0 +1,118 @@
+'''
+Forward an addon invocation to a running `sioyek.daemon` so that the addon doesn't have to pay
+the python/PyQt5/fitz startup cost on every keypress.
+
+Prefix the addon arguments with the addon name, for example:
+
+    new_command _embed_annotations python -m sioyek.client embed_annotations "%{sioyek_path}" "%{local_database}" "%{shared_database}" "%{file_path}"
+
+If the daemon is not running, it is started in the background and the addon is executed in this
+process as if it was invoked with `python -m sioyek.<addon>`.
+
+This module is intentionally kept free of heavy imports (PyQt5, fitz, numpy, etc.).
+'''
+
+import os
+import sys
+import getpass
+import runpy
+import subprocess
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+from appdirs import user_cache_dir
+
+DAEMON_NAME = 'sioyek-extensions-{}'.format(getpass.getuser())
+
+def check_owned_by_current_user(path):
+    '''
+    Raises PermissionError if `path` is a symlink or belongs to another user, so that other local users can't
+    plant the daemon's socket or key.
+    '''
+    if sys.platform == 'win32':
+        return
+    if os.path.islink(path) or os.lstat(path).st_uid != os.getuid():
+        raise PermissionError('{} is not owned by the current user'.format(path))
+
+def get_daemon_directory():
+    '''
+    Directory of the daemon's socket and authentication key, which only the current user can access.
+    '''
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if sys.platform != 'win32' and runtime_directory and os.path.isdir(runtime_directory):
+        directory = os.path.join(runtime_directory, 'sioyek')
+    else:
+        directory = os.path.join(user_cache_dir('sioyek', False), 'daemon')
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    check_owned_by_current_user(directory)
+    if sys.platform != 'win32' and os.stat(directory).st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+def get_daemon_address():
+    if sys.platform == 'win32':
+        return r'\\.\pipe\{}'.format(DAEMON_NAME)
+    else:
+        return os.path.join(get_daemon_directory(), DAEMON_NAME + '.sock')
+
+def get_daemon_authkey_path():
+    return os.path.join(get_daemon_directory(), DAEMON_NAME + '.key')
+
+def read_daemon_authkey():
+    authkey_path = get_daemon_authkey_path()
+    check_owned_by_current_user(authkey_path)
+    with open(authkey_path, 'rb') as infile:
+        return infile.read()
+
+def connect_to_daemon():
+    '''
+    Returns a connection to the running daemon or None if there is no running daemon.
+    '''
+    try:
+        address = get_daemon_address()
+        if sys.platform != 'win32':
+            check_owned_by_current_user(address)
+        return Client(address, authkey=read_daemon_authkey())
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+def start_daemon():
+    kwargs = dict(stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen([sys.executable, '-m', 'sioyek.daemon'], **kwargs)
+
+def run_in_process(argv):
+    sys.argv = argv
+    runpy.run_module('sioyek.' + argv[0], run_name='__main__', alter_sys=True)
+
+def send_to_daemon(connection, argv):
+    with connection:
+        connection.send(argv)
+        return connection.recv()
+
+def main(argv):
+    if len(argv) < 1:
+        print('usage: python -m sioyek.client <addon> [addon arguments ...]', file=sys.stderr)
+        return 1
+
+    connection = connect_to_daemon()
+    if connection == None:
+        start_daemon()
+        run_in_process(argv)
+        return 0
+
+    status, message = send_to_daemon(connection, argv)
+
+    if status == 'unsupported':
+        run_in_process(argv)
+    elif status == 'error':
+        print(message, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,272 @@
+'''
+A long-lived process which keeps PyQt5, fitz and the addon modules imported, and keeps the sioyek
+databases and the opened documents warm between addon invocations.
+
+Start it with:
+
+    python -m sioyek.daemon
+
+(`python -m sioyek.client` starts it automatically if it is not running) and stop it with:
+
+    python -m sioyek.daemon stop
+
+Addon invocations are forwarded to the daemon using `sioyek.client`, see the documentation of that module.
+'''
+
+import os
+import sys
+import socket
+import importlib
+import traceback
+from multiprocessing.connection import Listener
+from multiprocessing import AuthenticationError
+
+if sys.platform != 'win32':
+    import fcntl
+
+from .sioyek import Sioyek, Document, ANNOTATION_CACHE_KEYS, get_file_stamp
+from .client import DAEMON_NAME, get_daemon_directory, get_daemon_address, get_daemon_authkey_path, connect_to_daemon, send_to_daemon, check_owned_by_current_user
+
+# addons that expose a `main(argv, sioyek_factory)` function and can be executed inside the daemon
+DAEMON_ADDONS = [
+    'embed_annotations',
+    'import_annotations',
+    'remove_annotation',
+    'add_text',
+    'translate',
+    'extract_highlights',
+    'dual_panelify',
+]
+
+STOP_COMMAND = '__stop__'
+
+class DaemonDocument(Document):
+    '''
+    A document which stays open between addon invocations.
+    '''
+
+    def __init__(self, path, sioyek):
+        super().__init__(path, sioyek)
+        self.file_stamp = get_file_stamp(path)
+
+    def is_stale(self):
+        try:
+            return self.doc.is_closed or get_file_stamp(self.path) != self.file_stamp
+        except OSError:
+            return True
+
+    def save_changes(self, compact=False):
+        super().save_changes(compact)
+        # our own changes don't invalidate the opened document
+        self.file_stamp = get_file_stamp(self.path)
+
+    def close(self):
+        # the document is closed when it is changed on disk or when the daemon exits
+        pass
+
+    def close_document(self):
+        super().close()
+
+class DaemonSioyek(Sioyek):
+    '''
+    A `Sioyek` object whose database connections and documents are reused by all addon invocations.
+    '''
+
+    def __init__(self, sioyek_path, local_database_path=None, shared_database_path=None, force_binary=False, read_only_databases=False):
+        super().__init__(sioyek_path, local_database_path, shared_database_path, force_binary, read_only_databases)
+        self.documents = dict()
+
+    def prepare_for_request(self):
+        if (not self.force_binary) and (not self.is_connected_to_server()):
+            self.connect_to_server()
+
+        # sioyek may have opened new documents (or rehashed the existing ones) since the last request
+        self.cached_path_hash_map = None
+        self.cached_normalized_path_hash_map = None
+        self.highlight_embed_method = 'fitz'
+
+        for path, document in list(self.documents.items()):
+            if document.is_stale():
+                document.close_document()
+                del self.documents[path]
+            else:
+                document.cached_hash = None
+                # keep the expensive pages and text layers warm, the annotation lists are cheap to reload
+                document.page_cache.invalidate(keys=ANNOTATION_CACHE_KEYS)
+
+    def get_document(self, path):
+        key = os.path.normpath(path)
+        if key not in self.documents:
+            self.documents[key] = DaemonDocument(path, self)
+        return self.documents[key]
+
+    def close(self):
+        # keep the connections open for the next request, but don't leave uncommitted changes around
+        if self.local_database != None:
+            self.local_database.commit()
+        if self.shared_database != None:
+            self.shared_database.commit()
+
+    def close_all(self):
+        for document in self.documents.values():
+            document.close_document()
+        self.documents.clear()
+        if self.local_database != None:
+            self.local_database.close()
+        if self.shared_database != None:
+            self.shared_database.close()
+
+class ExtensionDaemon:
+
+    def __init__(self):
+        self.sioyeks = dict()
+        self.addon_mains = dict()
+
+    def get_addon_main(self, addon_name):
+        if addon_name not in DAEMON_ADDONS:
+            return None
+
+        if addon_name not in self.addon_mains:
+            module = importlib.import_module('.' + addon_name, __package__)
+            self.addon_mains[addon_name] = module.main
+        return self.addon_mains[addon_name]
+
+    def preload_addons(self):
+        for addon_name in DAEMON_ADDONS:
+            try:
+                self.get_addon_main(addon_name)
+            except ImportError as e:
+                print('could not preload {}: {}'.format(addon_name, str(e)))
+
+    def get_sioyek(self, sioyek_path, local_database_path=None, shared_database_path=None, force_binary=False, read_only_databases=False):
+        key = (sioyek_path, local_database_path, shared_database_path, force_binary, read_only_databases)
+        if key not in self.sioyeks:
+            self.sioyeks[key] = DaemonSioyek(sioyek_path, local_database_path, shared_database_path, force_binary, read_only_databases)
+        sioyek = self.sioyeks[key]
+        sioyek.prepare_for_request()
+        return sioyek
+
+    def handle_request(self, argv):
+        addon_main = self.get_addon_main(argv[0])
+        if addon_main == None:
+            return 'unsupported', None
+
+        try:
+            addon_main(argv, sioyek_factory=self.get_sioyek)
+            return 'ok', None
+        except Exception:
+            return 'error', traceback.format_exc()
+
+    def close(self):
+        for sioyek in self.sioyeks.values():
+            sioyek.close_all()
+        self.sioyeks.clear()
+
+    def serve(self):
+        if connect_to_daemon() != None:
+            print('sioyek daemon is already running')
+            return
+
+        lock_file = acquire_daemon_lock()
+        if lock_file == None:
+            print('sioyek daemon is already running')
+            return
+
+        with lock_file:
+            self.serve_locked()
+
+    def serve_locked(self):
+        address = get_daemon_address()
+        authkey = os.urandom(32)
+
+        if sys.platform != 'win32' and os.path.lexists(address):
+            if is_socket_listening(address):
+                print('sioyek daemon is already running')
+                return
+            # a socket file left behind by a daemon which was not stopped properly
+            check_owned_by_current_user(address)
+            os.remove(address)
+
+        with Listener(address, authkey=authkey) as listener:
+            authkey_path = get_daemon_authkey_path()
+            # we hold the daemon lock, so an existing key file was left behind by a previous daemon
+            if os.path.lexists(authkey_path):
+                check_owned_by_current_user(authkey_path)
+                os.remove(authkey_path)
+            authkey_file = os.open(authkey_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(authkey_file, 'wb') as outfile:
+                outfile.write(authkey)
+
+            try:
+                self.preload_addons()
+                self.accept_requests(listener)
+            finally:
+                self.close()
+                os.remove(authkey_path)
+
+    def accept_requests(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError, EOFError):
+                continue
+
+            with connection:
+                try:
+                    argv = connection.recv()
+                except (OSError, EOFError):
+                    continue
+
+                if argv == [STOP_COMMAND]:
+                    try:
+                        connection.send(('ok', None))
+                    except (OSError, EOFError):
+                        pass
+                    break
+
+                # the client may have been killed (or timed out) while the addon was running
+                try:
+                    connection.send(self.handle_request(argv))
+                except (OSError, EOFError):
+                    continue
+
+def acquire_daemon_lock():
+    '''
+    Takes the lock which is held by the running daemon, so that daemons which are started at the same time don't
+    remove each other's sockets. Returns the open lock file or None if another daemon holds the lock.
+    '''
+    lock_path = os.path.join(get_daemon_directory(), DAEMON_NAME + '.lock')
+    lock_file = open(lock_path, 'a')
+    if sys.platform == 'win32':
+        # named pipes can't be left behind, creating the pipe fails if another daemon is running
+        return lock_file
+
+    check_owned_by_current_user(lock_path)
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def is_socket_listening(address):
+    '''
+    Checks if a process is accepting connections on the unix socket at `address`.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(address)
+            return True
+        except OSError:
+            return False
+
+def stop_daemon():
+    connection = connect_to_daemon()
+    if connection != None:
+        send_to_daemon(connection, [STOP_COMMAND])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'stop':
+        stop_daemon()
+    else:
+        ExtensionDaemon().serve()
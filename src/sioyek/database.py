@@ -0,0 +1,227 @@
+'''
+Queries on the sioyek databases.
+
+All the queries use bound parameters, so the query strings are constant and sqlite3 reuses their prepared
+statements (each connection caches the statements of the most recently used query strings).
+
+Sioyek itself may be writing to the databases while an addon runs, so all the connections are opened
+with `connect`, which waits for locks instead of failing immediately, and writes are grouped into
+`write_transaction`s which take the write lock up front.
+'''
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+# how long to wait for sioyek to release a lock before failing with "database is locked"
+BUSY_TIMEOUT_SECONDS = 10
+# page cache size in KiB (negative values of the cache_size pragma are in KiB instead of pages)
+CACHE_SIZE_KIB = 16 * 1024
+MMAP_SIZE_BYTES = 64 * 1024 * 1024
+
+SELECT_DOCUMENT_HASH_QUERY = "SELECT hash FROM document_hash WHERE path = ? ORDER BY rowid DESC LIMIT 1"
+SELECT_ALL_DOCUMENT_HASHES_QUERY = "SELECT path, hash FROM document_hash ORDER BY rowid"
+INSERT_DOCUMENT_HASH_QUERY = "INSERT INTO document_hash (path, hash) VALUES (?, ?)"
+UPDATE_DOCUMENT_HASH_QUERY = "UPDATE document_hash SET hash = ? WHERE path = ?"
+
+SELECT_HIGHLIGHTS_QUERY = "SELECT desc, type, begin_x, begin_y, end_x, end_y FROM highlights WHERE document_path = ?"
+SELECT_HIGHLIGHTS_AFTER_ROWID_QUERY = "SELECT desc, type, begin_x, begin_y, end_x, end_y FROM highlights WHERE document_path = ? AND rowid > ?"
+SELECT_ALL_HIGHLIGHTS_QUERY = "SELECT document_path, desc, type, begin_x, begin_y, end_x, end_y FROM highlights"
+INSERT_HIGHLIGHT_QUERY = "INSERT INTO highlights (document_path, desc, type, begin_x, begin_y, end_x, end_y) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+SELECT_BOOKMARKS_QUERY = "SELECT desc, offset_y FROM bookmarks WHERE document_path = ?"
+SELECT_BOOKMARKS_AFTER_ROWID_QUERY = "SELECT desc, offset_y FROM bookmarks WHERE document_path = ? AND rowid > ?"
+SELECT_ALL_BOOKMARKS_QUERY = "SELECT document_path, desc, offset_y FROM bookmarks"
+INSERT_BOOKMARK_QUERY = "INSERT INTO bookmarks (document_path, desc, offset_y) VALUES (?, ?, ?)"
+
+# tables whose rows are tracked by `get_row_watermark`
+WATERMARK_TABLES = ['highlights', 'bookmarks']
+SELECT_LAST_ROW_QUERY = "SELECT rowid, desc FROM {} WHERE document_path = ? ORDER BY rowid DESC LIMIT 1"
+SELECT_ROW_DESC_QUERY = "SELECT desc FROM {} WHERE document_path = ? AND rowid = ?"
+COUNT_ROWS_UNTIL_QUERY = "SELECT COUNT(*) FROM {} WHERE document_path = ? AND rowid <= ?"
+
+INSERT_PORTAL_QUERY = "INSERT INTO links (src_document, dst_document, src_offset_y, dst_offset_x, dst_offset_y, dst_zoom_level) VALUES (?, ?, ?, ?, ?, ?)"
+DELETE_PORTALS_QUERY = "DELETE FROM links WHERE src_document = ?"
+
+SELECT_INDEX_NAMES_QUERY = "SELECT name FROM sqlite_master WHERE type = 'index'"
+
+# (index name, table, column) of the indexes that our queries rely on. They are not covering indexes on purpose: the
+# queries select most of the columns, so a covering index would double the size of the tables. Every index contains
+# the rowid, so the rowid watermark queries (see `get_row_watermark`) are answered from the index alone.
+LOCAL_DATABASE_INDEXES = [
+    ('sioyek_python_document_hash_path', 'document_hash', 'path'),
+]
+SHARED_DATABASE_INDEXES = [
+    ('sioyek_python_highlights_document_path', 'highlights', 'document_path'),
+    ('sioyek_python_bookmarks_document_path', 'bookmarks', 'document_path'),
+    ('sioyek_python_links_src_document', 'links', 'src_document'),
+]
+
+def connect(path, read_only=False):
+    '''
+    Opens a connection to the sioyek database at `path`. Read only connections never take the write lock, so
+    they don't block sioyek (and with a WAL journal, sioyek's writes don't block them).
+    '''
+    if read_only:
+        uri = 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+        connection = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+    else:
+        connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS)
+
+    # the journal mode is sioyek's decision, we only tune the settings which are local to our connection
+    connection.execute('PRAGMA cache_size = {}'.format(-CACHE_SIZE_KIB))
+    connection.execute('PRAGMA mmap_size = {}'.format(MMAP_SIZE_BYTES))
+    return connection
+
+@contextmanager
+def write_transaction(connection):
+    '''
+    Runs the writes of the `with` block in a single transaction, which is committed when the block exits
+    and rolled back if it raises. `BEGIN IMMEDIATE` takes the write lock at the beginning, so if sioyek is
+    writing we wait for it (up to the busy timeout) instead of failing when upgrading a read lock. If the
+    connection is already in a transaction, the writes become part of that transaction.
+    '''
+    if connection.in_transaction:
+        yield connection
+        return
+
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except:
+        connection.rollback()
+        raise
+    connection.commit()
+
+def table_exists(connection, table):
+    query = "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?"
+    return connection.execute(query, (table,)).fetchone() != None
+
+def has_index_on_column(connection, table, column):
+    '''
+    Checks if any index of the table (including the ones created by sioyek itself) starts with `column`.
+    '''
+    # PRAGMA statements can't have bound parameters, table names come from the constant lists above
+    for index in connection.execute('PRAGMA index_list({})'.format(table)).fetchall():
+        index_name = index[1]
+        index_columns = connection.execute('PRAGMA index_info("{}")'.format(index_name)).fetchall()
+        if len(index_columns) > 0 and index_columns[0][2] == column:
+            return True
+    return False
+
+def get_missing_indexes(connection, indexes):
+    '''
+    Returns the indexes of `indexes` which are not in the database and whose column isn't indexed by sioyek either.
+    '''
+    existing_indexes = set(row[0] for row in connection.execute(SELECT_INDEX_NAMES_QUERY))
+    return [(index_name, table, column) for index_name, table, column in indexes
+        if index_name not in existing_indexes and table_exists(connection, table) and (not has_index_on_column(connection, table, column))]
+
+def ensure_indexes(connection, indexes):
+    '''
+    Creates the missing indexes. Usually they already exist and this is a single read of the schema. Creating them
+    doesn't wait for sioyek to release the write lock; if sioyek is writing we try again in the next run. Failing
+    to create them is not an error, the queries work without them, just slower.
+    '''
+    try:
+        missing_indexes = get_missing_indexes(connection, indexes)
+        if len(missing_indexes) == 0:
+            return
+
+        connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            for index_name, table, column in missing_indexes:
+                connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(index_name, table, column))
+            connection.commit()
+        finally:
+            connection.execute('PRAGMA busy_timeout = {}'.format(BUSY_TIMEOUT_SECONDS * 1000))
+    except sqlite3.Error:
+        if connection.in_transaction:
+            connection.rollback()
+
+def get_document_hash(local_database, path):
+    result = local_database.execute(SELECT_DOCUMENT_HASH_QUERY, (path,)).fetchone()
+    if result != None:
+        return result[0]
+    return None
+
+def get_path_hash_map(local_database):
+    return dict(local_database.execute(SELECT_ALL_DOCUMENT_HASHES_QUERY).fetchall())
+
+def set_document_hash(local_database, path, document_hash):
+    prev_hash = get_document_hash(local_database, path)
+    if prev_hash != None and prev_hash != document_hash:
+        local_database.execute(UPDATE_DOCUMENT_HASH_QUERY, (document_hash, path))
+
+    if prev_hash == None:
+        local_database.execute(INSERT_DOCUMENT_HASH_QUERY, (path, document_hash))
+
+def get_highlight_rows(shared_database, document_hash, after_rowid=None):
+    '''
+    Returns (text, type, begin_x, begin_y, end_x, end_y) tuples, only of the rows after `after_rowid` if it is given.
+    '''
+    if after_rowid != None:
+        return shared_database.execute(SELECT_HIGHLIGHTS_AFTER_ROWID_QUERY, (document_hash, after_rowid)).fetchall()
+    return shared_database.execute(SELECT_HIGHLIGHTS_QUERY, (document_hash,)).fetchall()
+
+def get_bookmark_rows(shared_database, document_hash, after_rowid=None):
+    '''
+    Returns (description, offset_y) tuples, only of the rows after `after_rowid` if it is given.
+    '''
+    if after_rowid != None:
+        return shared_database.execute(SELECT_BOOKMARKS_AFTER_ROWID_QUERY, (document_hash, after_rowid)).fetchall()
+    return shared_database.execute(SELECT_BOOKMARKS_QUERY, (document_hash,)).fetchall()
+
+def get_row_watermark(shared_database, table, document_hash):
+    '''
+    Returns a [last_rowid, num_rows, last_desc] list describing the current rows of the document in `table`. Rows are
+    appended with increasing rowids, so the rows added after the watermark are the ones with rowid > last_rowid.
+    '''
+    assert table in WATERMARK_TABLES
+    last_row = shared_database.execute(SELECT_LAST_ROW_QUERY.format(table), (document_hash,)).fetchone()
+    if last_row == None:
+        return [0, 0, None]
+    num_rows = shared_database.execute(COUNT_ROWS_UNTIL_QUERY.format(table), (document_hash, last_row[0])).fetchone()[0]
+    return [last_row[0], num_rows, last_row[1]]
+
+def is_row_watermark_valid(shared_database, table, document_hash, watermark):
+    '''
+    Checks that the rows described by the watermark are still in the table, i.e. none of them were deleted (or
+    replaced by a new row with the same rowid).
+    '''
+    assert table in WATERMARK_TABLES
+    last_rowid, num_rows, last_desc = watermark
+    if shared_database.execute(COUNT_ROWS_UNTIL_QUERY.format(table), (document_hash, last_rowid)).fetchone()[0] != num_rows:
+        return False
+    if num_rows == 0:
+        return True
+    last_row = shared_database.execute(SELECT_ROW_DESC_QUERY.format(table), (document_hash, last_rowid)).fetchone()
+    return last_row != None and last_row[0] == last_desc
+
+def iter_all_highlight_rows(shared_database):
+    '''
+    Yields (document_hash, text, type, begin_x, begin_y, end_x, end_y) tuples of the highlights of all the documents.
+    '''
+    return shared_database.execute(SELECT_ALL_HIGHLIGHTS_QUERY)
+
+def iter_all_bookmark_rows(shared_database):
+    '''
+    Yields (document_hash, description, offset_y) tuples of the bookmarks of all the documents.
+    '''
+    return shared_database.execute(SELECT_ALL_BOOKMARKS_QUERY)
+
+def insert_highlight_rows(shared_database, rows):
+    shared_database.executemany(INSERT_HIGHLIGHT_QUERY, rows)
+
+def insert_bookmark_rows(shared_database, rows):
+    shared_database.executemany(INSERT_BOOKMARK_QUERY, rows)
+
+def delete_portals_of_document(shared_database, document_hash):
+    shared_database.execute(DELETE_PORTALS_QUERY, (document_hash,))
+
+def insert_portal_rows(shared_database, rows):
+    '''
+    `rows` are (src_document, dst_document, src_offset_y, dst_offset_x, dst_offset_y, dst_zoom_level) tuples.
+    '''
+    shared_database.executemany(INSERT_PORTAL_QUERY, rows)
@@ -12,142 +12,396 @@ Or you can enter them as text in sioyek:
     new_command _dual_panelify python -m sioyek.dual_panelify "%{sioyek_path}" "%{file_path}" "%{command_text}"
 '''
 
+import os
 import sys
-import random
+import time
+import shutil
+import tempfile
+import hashlib
 import subprocess
-import datetime
 import fitz
 from copy import copy
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from .sioyek import Sioyek, clean_path
+from appdirs import user_cache_dir
+
+from .sioyek import Sioyek, clean_path, md5_hash, get_file_stamp, read_json_file, write_json_file, get_worker_chunk_size
 
 from PyPDF2 import PdfWriter, PdfReader, PageObject, Transformation
 
 UPDATE_EVERY_SECONDS = 3
+# the page pairs are merged in chunks which are written to temporary files and concatenated at the end
+PAIRS_PER_CHUNK = 32
+# 'pypdf2' merges the page contents, 'fitz' places the pages as form XObjects (which is much faster, but drops the
+# annotations, see `write_dual_panel_chunk_fitz`)
+DEFAULT_ENGINE = 'pypdf2'
 SIDE_MARGIN = 25
 MIDDLE_MARGIN = 25
+CACHE_APPNAME = 'sioyek'
 sioyek = None
 
-def first_and_last_nonzero(arr):
-    first_index = -1
-    last_index=-1
-    index = 0
-
-    while arr[index] == 0 and index < arr.size:
-        index += 1
-    
-    if index < arr.size:
-        first_index = index-1
-    
-    index = arr.size - 1
-    while arr[index] == 0 and index >= 0:
-        index -= 1
-    last_index = index + 1
-    return first_index, last_index
-
-def get_pixmap_bounding_box(pixmap):
-    pixmap_np = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, 3).mean(axis=2)
-
-    vertical_hist = 255 - pixmap_np.sum(axis=0)
-    vertical_hist_copy = vertical_hist.copy()
-    v_nth = vertical_hist.size // 3
-    vertical_hist_copy.partition(v_nth)
-    v_thresh = vertical_hist_copy[v_nth]
-    v_foreground = vertical_hist > v_thresh
-    v_first_nonzero, v_last_nonzero = first_and_last_nonzero(v_foreground)
-
-    bottom_right_x = v_last_nonzero
-    bottom_right_y = pixmap.height
-    
-    top_left_x = v_first_nonzero
-    top_left_y = 0
-
-    return fitz.Rect(top_left_x, top_left_y, bottom_right_x, bottom_right_y)
-
-def rect_union(rect1, rect2):
-    return fitz.Rect(min(rect1.x0, rect2.x0), min(rect1.y0, rect2.y0), max(rect1.x1, rect2.x1), max(rect1.y1, rect2.y1))
-
-def get_document_cropbox(doc):
-    pages = [random.randint(0, doc.page_count-1) for _ in range(5)]
-    boxes = []
-
-    for i in pages:
-        page = doc.load_page(i)
-        pixmap = page.get_pixmap()
-        boxes.append(get_pixmap_bounding_box(pixmap))
-    
-    res = boxes[0]
-    for box in boxes[1:]:
-        res = rect_union(res, box)
-    
-    res.x0 -= 5
-    res.x1 += 5
-    return res
+def merge_page_pair(page1, page2, side_margin, middle_margin):
+    page1 = copy(page1)
+    page2 = copy(page2)
 
-if __name__ == '__main__':
-    last_update_time = datetime.datetime.now()
+    llx = page1.cropbox.lower_right[0]
+    lly = page1.cropbox.lower_right[1]
+    page2.cropbox.lower_left = (llx, lly)
 
-    sioyek_path = clean_path(sys.argv[1])
-    sioyek = Sioyek(sioyek_path)
-    single_panel_file_path = clean_path(sys.argv[2])
-    if len(sys.argv) > 3:
-        margin_string = sys.argv[3]
-        parts = margin_string.split(' ')
-        if len(parts) > 1:
-            SIDE_MARGIN = int(parts[0])
-            MIDDLE_MARGIN = int(parts[1])
+    urx = page1.cropbox.lower_right[0] + page2.cropbox.lower_right[0]
+    ury = page2.cropbox.upper_right[1]
+    page2.cropbox.upper_right = (urx, ury)
 
-    dual_panel_file_path = single_panel_file_path.replace('.pdf', '_dual_panel.pdf')
+    total_width = page1.mediabox.width + page2.mediabox.width + 2 * side_margin + middle_margin
+    total_height = max([page1.mediabox.height, page2.mediabox.height])
+    new_page = PageObject.create_blank_page(None, total_width, total_height)
 
-    pdf_reader = PdfReader(single_panel_file_path)
-    pdf_writer = PdfWriter()
+    page1.add_transformation(Transformation().translate(side_margin, 0))
+    new_page.merge_page(page1)
 
-    doc = fitz.open(single_panel_file_path)
-    cropbox = get_document_cropbox(doc)
+    page2.add_transformation(Transformation().translate(page1.mediabox.width + side_margin + middle_margin, 0))
+    new_page.merge_page(page2)
+    return new_page
+
+def get_num_pairs(num_pages):
+    # a trailing unpaired page is a "pair" of one page, which is copied as is
+    return (num_pages + 1) // 2
 
-    for i in range(len(pdf_reader.pages) // 2):
-        if (datetime.datetime.now() - last_update_time).seconds > UPDATE_EVERY_SECONDS:
-            last_update_time = datetime.datetime.now()
-            # subprocess.run([sioyek_path, '--execute-command', 'set_status_string', '--execute-command-data', 'Dual panelifying {} / {}'.format((i+1) * 2, pdf_reader.numPages)])
-            sioyek.set_status_string('Dual panelifying {} / {}'.format((i+1) * 2, len(pdf_reader.pages)))
+def get_pair_pages(pair_index, num_pages):
+    return range(2 * pair_index, min(2 * pair_index + 2, num_pages))
 
-        page1 = copy(pdf_reader.pages[2 * i])
-        page2 = copy(pdf_reader.pages[2 * i+1])
+def get_pair_chunks(pair_indices, pairs_per_chunk):
+    return [pair_indices[begin:begin + pairs_per_chunk] for begin in range(0, len(pair_indices), pairs_per_chunk)]
 
-        original_width1 = page1.mediabox.width
-        original_width2 = page2.mediabox.width
+def write_dual_panel_chunk(file_path, pair_indices, num_pages, side_margin, middle_margin, output_path):
+    '''
+    Writes the dual panel pages of the given page pairs to `output_path`. This runs in the worker processes, so
+    it opens the file itself. Returns the number of processed single panel pages.
+    '''
+    pdf_reader = PdfReader(file_path)
+    pdf_writer = PdfWriter()
+    num_done = 0
 
-        llx = page1.cropbox.lower_right[0]
-        lly = page1.cropbox.lower_right[1]
-        page2.cropbox.lower_left = (llx, lly)
+    for pair_index in pair_indices:
+        pages = get_pair_pages(pair_index, num_pages)
+        if len(pages) == 2:
+            pdf_writer.add_page(merge_page_pair(pdf_reader.pages[pages[0]], pdf_reader.pages[pages[1]], side_margin, middle_margin))
+        else:
+            pdf_writer.add_page(pdf_reader.pages[pages[0]])
+        num_done += len(pages)
 
-        urx = page1.cropbox.lower_right[0] + page2.cropbox.lower_right[0]
-        ury = page2.cropbox.upper_right[1]
-        page2.cropbox.upper_right = (urx, ury)
+    with open(output_path, 'wb') as f:
+        pdf_writer.write(f)
+    return num_done
+
+def write_dual_panel_chunks(write_chunk, tasks, workers):
+    '''
+    Runs `write_chunk` for each of the argument tuples in `tasks` and yields the results as the chunks are
+    finished (in a pool of `workers` processes if `workers` is more than one).
+    '''
+    if workers != None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(write_chunk, *task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+    else:
+        for task in tasks:
+            yield write_chunk(*task)
+
+def concatenate_pdf_files(file_paths, output_path):
+    output_doc = fitz.open()
+    for file_path in file_paths:
+        with fitz.open(file_path) as doc:
+            output_doc.insert_pdf(doc)
+    # the chunks have their own copies of the shared resources (e.g. fonts), merge the duplicates
+    output_doc.save(output_path, garbage=3)
+    output_doc.close()
+
+class ProgressReporter:
+    '''
+    Shows the progress and the throughput in sioyek's statusbar, at most once every `UPDATE_EVERY_SECONDS` seconds.
+    '''
+
+    def __init__(self, sioyek, num_pages):
+        self.sioyek = sioyek
+        self.num_pages = num_pages
+        self.start_time = time.time()
+        self.last_update_time = self.start_time
+
+    def update(self, num_done):
+        now = time.time()
+        if now - self.last_update_time > UPDATE_EVERY_SECONDS:
+            self.last_update_time = now
+            self.sioyek.set_status_string('Dual panelifying {} / {} ({:.1f} pages/s)'.format(num_done, self.num_pages, num_done / (now - self.start_time)))
+
+def write_dual_panel_file_in_chunks(write_chunk, file_path, output_path, num_pages, side_margin, middle_margin, progress, workers, pair_indices, pairs_per_chunk):
+    '''
+    Writes the chunks of `pair_indices` to temporary files with `write_chunk` (by a pool of `workers` processes if
+    `workers` is more than one) and concatenates them into `output_path`.
+    '''
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chunks = get_pair_chunks(pair_indices, pairs_per_chunk)
+        chunk_paths = [os.path.join(temp_dir, 'chunk_{}.pdf'.format(i)) for i in range(len(chunks))]
+        tasks = [(file_path, chunk, num_pages, side_margin, middle_margin, chunk_path) for chunk, chunk_path in zip(chunks, chunk_paths)]
+
+        num_done = 0
+        for num_chunk_pages in write_dual_panel_chunks(write_chunk, tasks, workers):
+            num_done += num_chunk_pages
+            progress.update(num_done)
+
+        concatenate_pdf_files(chunk_paths, output_path)
+
+def write_dual_panel_file_pypdf2(file_path, output_path, num_pages, side_margin, middle_margin, progress, workers=None, pair_indices=None):
+    '''
+    Writes the dual panel pages of `pair_indices` (all the pairs if None) to `output_path`. The pairs are merged
+    in chunks which are written to temporary files, by a pool of `workers` processes if `workers` is more than one.
+    '''
+    if pair_indices == None:
+        pair_indices = list(range(get_num_pairs(num_pages)))
+
+    write_dual_panel_file_in_chunks(write_dual_panel_chunk, file_path, output_path, num_pages, side_margin, middle_margin,
+        progress, workers, pair_indices, PAIRS_PER_CHUNK)
+
+def write_dual_panel_chunk_fitz(file_path, pair_indices, num_pages, side_margin, middle_margin, output_path, progress=None):
+    '''
+    Same as `write_dual_panel_chunk`, but the pages are placed with fitz's `show_pdf_page`, which adds each source
+    page to the new document once (as a form XObject) instead of copying and transforming its content stream.
+    `show_pdf_page` only shows the page contents, so the annotations of the paired pages are not copied.
+    '''
+    source_doc = fitz.open(file_path)
+    output_doc = fitz.open()
+    num_done = 0
+
+    for pair_index in pair_indices:
+        pages = get_pair_pages(pair_index, num_pages)
+        num_done += len(pages)
+
+        if len(pages) == 1:
+            output_doc.insert_pdf(source_doc, from_page=pages[0], to_page=pages[0])
+            continue
+
+        page1_rect = source_doc[pages[0]].rect
+        page2_rect = source_doc[pages[1]].rect
+
+        total_width = page1_rect.width + page2_rect.width + 2 * side_margin + middle_margin
+        total_height = max(page1_rect.height, page2_rect.height)
+        new_page = output_doc.new_page(width=total_width, height=total_height)
+
+        # like the PyPDF2 engine, the pages are aligned at the bottom
+        page1_x = side_margin
+        page2_x = page1_rect.width + side_margin + middle_margin
+        new_page.show_pdf_page(fitz.Rect(page1_x, total_height - page1_rect.height, page1_x + page1_rect.width, total_height), source_doc, pages[0])
+        new_page.show_pdf_page(fitz.Rect(page2_x, total_height - page2_rect.height, page2_x + page2_rect.width, total_height), source_doc, pages[1])
+        if progress != None:
+            progress.update(num_done)
+
+    output_doc.save(output_path, garbage=3)
+    output_doc.close()
+    source_doc.close()
+    return num_done
+
+def write_dual_panel_file_fitz(file_path, output_path, num_pages, side_margin, middle_margin, progress, workers=None, pair_indices=None):
+    '''
+    Same as `write_dual_panel_file_pypdf2`, but with `write_dual_panel_chunk_fitz`. Without workers the whole file
+    is written at once, with workers it is split into a few chunks per worker.
+    '''
+    if pair_indices == None:
+        pair_indices = list(range(get_num_pairs(num_pages)))
+
+    if workers == None or workers <= 1:
+        write_dual_panel_chunk_fitz(file_path, pair_indices, num_pages, side_margin, middle_margin, output_path, progress)
+        return
+
+    write_dual_panel_file_in_chunks(write_dual_panel_chunk_fitz, file_path, output_path, num_pages, side_margin, middle_margin,
+        progress, workers, pair_indices, get_worker_chunk_size(len(pair_indices), workers))
+
+DUAL_PANEL_ENGINES = {
+    'pypdf2': write_dual_panel_file_pypdf2,
+    'fitz': write_dual_panel_file_fitz,
+}
+
+def replace_dual_panel_pairs(file_path, output_path, num_pages, side_margin, middle_margin, progress, engine, workers, pair_indices):
+    '''
+    Regenerates the pages of `pair_indices` in an existing dual panel file (the i'th page of the dual panel file
+    is the i'th pair).
+    '''
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pairs_file_path = os.path.join(temp_dir, 'pairs.pdf')
+        DUAL_PANEL_ENGINES[engine](file_path, pairs_file_path, num_pages, side_margin, middle_margin, progress, workers, pair_indices)
+
+        output_doc = fitz.open(output_path)
+        with fitz.open(pairs_file_path) as pairs_doc:
+            for i, pair_index in enumerate(pair_indices):
+                output_doc.delete_page(pair_index)
+                output_doc.insert_pdf(pairs_doc, from_page=i, to_page=i, start_at=pair_index)
+
+        # the replaced pages are garbage collected, so rewrite the file instead of appending a revision
+        temp_output_path = os.path.join(temp_dir, 'output.pdf')
+        output_doc.save(temp_output_path, garbage=3)
+        output_doc.close()
+        shutil.move(temp_output_path, output_path)
+
+def get_page_fingerprints(doc, engine):
+    '''
+    Hashes of the content streams, geometry and (if the engine copies them) annotations of the pages, used to find
+    the pages which changed since the dual panel file was created.
+    '''
+    fingerprints = []
+    for page in doc:
+        fingerprint = hashlib.md5()
+        fingerprint.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+        fingerprint.update(page.read_contents())
+        if engine_copies_annotations(engine, page.number, doc.page_count):
+            for annot_xref, _, _ in page.annot_xrefs():
+                fingerprint.update(doc.xref_object(annot_xref, compressed=True).encode())
+        fingerprints.append(fingerprint.hexdigest())
+    return fingerprints
+
+def engine_copies_annotations(engine, page_number, num_pages):
+    # the fitz engine only copies the trailing unpaired page as is, see `write_dual_panel_chunk_fitz`
+    if engine == 'fitz':
+        return len(get_pair_pages(page_number // 2, num_pages)) == 1
+    return True
+
+def get_changed_pairs(old_fingerprints, new_fingerprints):
+    num_pages = len(new_fingerprints)
+    changed_pairs = []
+    for pair_index in range(get_num_pairs(num_pages)):
+        if any(old_fingerprints[i] != new_fingerprints[i] for i in get_pair_pages(pair_index, num_pages)):
+            changed_pairs.append(pair_index)
+    return changed_pairs
+
+def get_output_state_file_path(output_path):
+    path_hash = hashlib.md5(os.path.abspath(output_path).encode('utf8')).hexdigest()
+    return os.path.join(user_cache_dir(CACHE_APPNAME, False), 'dual_panelify_output', path_hash + '.json')
+
+def get_output_stamp(output_path):
+    if not os.path.exists(output_path):
+        return None
+    return list(get_file_stamp(output_path))
+
+def get_source_hash(file_path, source_stamp, state):
+    '''
+    md5 hash of the source file. Hashing a large book takes a while, so if the file hasn't changed since the dual
+    panel file was created (same size and modification time), the hash in the state file is used.
+    '''
+    if state != None and state.get('source_stamp') == source_stamp:
+        return state['key'][0]
+    return md5_hash(file_path)
+
+def get_pairs_to_update(state, output_key, output_stamp, num_pages, doc, engine):
+    '''
+    Returns (pair_indices, page_fingerprints) where `pair_indices` are the pairs of the existing dual panel file
+    which need to be regenerated (None if the whole file has to be created) and `page_fingerprints` are the
+    fingerprints of the source pages if we know them.
+    '''
+    # the dual panel file is missing or was changed by something else
+    if state == None or output_stamp == None or state.get('output_stamp') != output_stamp:
+        return None, None
+
+    if state['key'] == output_key:
+        return [], state['page_fingerprints']
+
+    # the file was created with other settings, all the pages are different
+    if state['key'][1:] != output_key[1:] or len(state['page_fingerprints']) != num_pages:
+        return None, None
+
+    page_fingerprints = get_page_fingerprints(doc, engine)
+    return get_changed_pairs(state['page_fingerprints'], page_fingerprints), page_fingerprints
+
+def benchmark_engines(sioyek, file_path, output_path, num_pages, side_margin, middle_margin, workers, engine):
+    '''
+    Creates the dual panel file with all the engines and shows their running times and output sizes in sioyek's
+    statusbar. The output of `engine` is kept at `output_path`.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for engine_name, write_dual_panel_file in DUAL_PANEL_ENGINES.items():
+            engine_output_path = os.path.join(temp_dir, engine_name + '.pdf')
+            start_time = time.time()
+            write_dual_panel_file(file_path, engine_output_path, num_pages, side_margin, middle_margin, ProgressReporter(sioyek, num_pages), workers)
+            elapsed = time.time() - start_time
+            results.append('{}: {:.2f}s, {:.1f} MB'.format(engine_name, elapsed, os.path.getsize(engine_output_path) / (1024 * 1024)))
+
+            if engine_name == engine:
+                shutil.move(engine_output_path, output_path)
+
+    return 'Dual panelify benchmark ({} pages) - {}'.format(num_pages, ', '.join(results))
+
+def main(argv, sioyek_factory=Sioyek):
+    side_margin = SIDE_MARGIN
+    middle_margin = MIDDLE_MARGIN
+
+    sioyek_path = clean_path(argv[1])
+    sioyek = sioyek_factory(sioyek_path)
+    single_panel_file_path = clean_path(argv[2])
+    if len(argv) > 3 and (not argv[3].startswith('--')):
+        margin_string = argv[3]
+        parts = margin_string.split(' ')
+        if len(parts) > 1:
+            side_margin = int(parts[0])
+            middle_margin = int(parts[1])
 
+    # merge the page chunks in parallel with --workers=N
+    workers = None
+    # select the engine with --engine=fitz or --engine=pypdf2
+    engine = DEFAULT_ENGINE
+    for arg in argv[3:]:
+        if arg.startswith('--workers='):
+            workers = int(arg[len('--workers='):])
+        if arg.startswith('--engine='):
+            engine = arg[len('--engine='):]
 
-        # total_width = original_width1 + original_width2
-        total_width = page1.mediabox.width + page2.mediabox.width + 2 * SIDE_MARGIN + MIDDLE_MARGIN
-        total_height = max([page1.mediabox.height, page2.mediabox.height])
-        new_page = PageObject.create_blank_page(None, total_width, total_height)
+    # compare the running times and output sizes of the engines
+    benchmark = '--benchmark' in argv[3:]
 
-        # new_page.mergeTranslatedPage(page1, -page1.mediabox.left + SIDE_MARGIN, 0)
-        page1.add_transformation(Transformation().translate( SIDE_MARGIN, 0))
-        new_page.merge_page(page1)
+    # recreate the whole file even if the existing one is up to date
+    force = '--force' in argv[3:]
 
-        # new_page.mergeTranslatedPage(page2, page1.mediabox.width - page1.mediabox.left + SIDE_MARGIN + MIDDLE_MARGIN, 0)
-        page2.add_transformation(Transformation().translate(page1.mediabox.width + SIDE_MARGIN + MIDDLE_MARGIN, 0))
-        new_page.merge_page(page2)
+    if engine not in DUAL_PANEL_ENGINES:
+        sioyek.set_status_string('Unknown dual panelify engine: {}'.format(engine))
+        return
 
-        pdf_writer.add_page(new_page)
-    
-    if len(pdf_reader.pages) % 2 == 1:
-        pdf_writer.add_page(pdf_reader.pages[len(pdf_reader.pages) - 1])
+    dual_panel_file_path = single_panel_file_path.replace('.pdf', '_dual_panel.pdf')
 
-    sioyek.set_status_string('Writing new file to disk')
-    with open(dual_panel_file_path, 'wb') as f:
-        pdf_writer.write(f)
+    doc = fitz.open(single_panel_file_path)
+    num_pages = doc.page_count
+
+    state_file_path = get_output_state_file_path(dual_panel_file_path)
+    state = read_json_file(state_file_path)
+    source_stamp = list(get_file_stamp(single_panel_file_path))
+    source_hash = get_source_hash(single_panel_file_path, source_stamp, state)
+
+    output_key = [source_hash, side_margin, middle_margin, engine]
+    pair_indices, page_fingerprints = None, None
+    if not (force or benchmark):
+        pair_indices, page_fingerprints = get_pairs_to_update(state, output_key, get_output_stamp(dual_panel_file_path), num_pages, doc, engine)
+
+    if page_fingerprints == None:
+        page_fingerprints = get_page_fingerprints(doc, engine)
+    doc.close()
+
+    if benchmark:
+        summary = benchmark_engines(sioyek, single_panel_file_path, dual_panel_file_path, num_pages, side_margin, middle_margin, workers, engine)
+        sioyek.set_status_string(summary)
+    elif pair_indices == None:
+        write_dual_panel_file = DUAL_PANEL_ENGINES[engine]
+        write_dual_panel_file(single_panel_file_path, dual_panel_file_path, num_pages, side_margin, middle_margin, ProgressReporter(sioyek, num_pages), workers)
+        sioyek.clear_status_string()
+    elif len(pair_indices) > 0:
+        num_changed_pages = sum(len(get_pair_pages(pair_index, num_pages)) for pair_index in pair_indices)
+        replace_dual_panel_pairs(single_panel_file_path, dual_panel_file_path, num_pages, side_margin, middle_margin,
+            ProgressReporter(sioyek, num_changed_pages), engine, workers, pair_indices)
+        sioyek.clear_status_string()
+
+    write_json_file(state_file_path, {
+        'key': output_key,
+        'source_stamp': source_stamp,
+        'output_stamp': get_output_stamp(dual_panel_file_path),
+        'page_fingerprints': page_fingerprints,
+    })
+
+    subprocess.run([sioyek_path, '--new-window', dual_panel_file_path])
 
-    sioyek.clear_status_string()
-    subprocess.run([sioyek_path, '--new-window', dual_panel_file_path])
\ No newline at end of file
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,22 +1,37 @@
 import sys
 from .sioyek import Sioyek, clean_path
 
-if __name__ == '__main__':
-    SIOYEK_PATH = clean_path(sys.argv[1])
-    LOCAL_DATABASE_PATH = clean_path(sys.argv[2])
-    SHARED_DATABASE_PATH = clean_path(sys.argv[3])
-    FILE_PATH = clean_path(sys.argv[4])
+def main(argv, sioyek_factory=Sioyek):
+    SIOYEK_PATH = clean_path(argv[1])
+    LOCAL_DATABASE_PATH = clean_path(argv[2])
+    SHARED_DATABASE_PATH = clean_path(argv[3])
+    FILE_PATH = clean_path(argv[4])
 
-    if len(sys.argv) > 5:
-        embed_method = sys.argv[5] 
+    if len(argv) > 5 and (not argv[5].startswith('--')):
+        embed_method = argv[5] 
     else:
         embed_method = 'custom'
 
+    # process the pages in parallel with --workers=N
+    workers = None
+    for arg in argv[5:]:
+        if arg.startswith('--workers='):
+            workers = int(arg[len('--workers='):])
+
+    # compare all the annotations instead of only the ones which changed since the last sync
+    incremental = '--full-sync' not in argv[5:]
+
+    # rewrite the whole file when it has too many incremental revisions
+    compact = '--compact' in argv[5:]
 
-    sioyek = Sioyek(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH)
+
+    sioyek = sioyek_factory(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH, read_only_databases=True)
     sioyek.set_highlight_embed_method(embed_method)
     document = sioyek.get_document(FILE_PATH)
-    document.embed_new_annotations(save=True)
+    document.embed_new_annotations(save=True, workers=workers, compact=compact, incremental=incremental)
     document.close()
     sioyek.reload()
     sioyek.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
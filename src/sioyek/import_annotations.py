@@ -1,20 +1,36 @@
 import sys
 from .sioyek import Sioyek, clean_path
 
-if __name__ == '__main__':
-    SIOYEK_PATH = clean_path(sys.argv[1])
-    LOCAL_DATABASE_PATH = clean_path(sys.argv[2])
-    SHARED_DATABASE_PATH = clean_path(sys.argv[3])
-    FILE_PATH = clean_path(sys.argv[4])
+def main(argv, sioyek_factory=Sioyek):
+    SIOYEK_PATH = clean_path(argv[1])
+    LOCAL_DATABASE_PATH = clean_path(argv[2])
+    SHARED_DATABASE_PATH = clean_path(argv[3])
+    FILE_PATH = clean_path(argv[4])
 
-    if len(sys.argv) > 5:
-        embed_method = sys.argv[5] 
+    if len(argv) > 5 and (not argv[5].startswith('--')):
+        embed_method = argv[5] 
     else:
         embed_method = 'custom'
 
-    sioyek = Sioyek(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH)
+    # process the pages in parallel with --workers=N
+    workers = None
+    for arg in argv[5:]:
+        if arg.startswith('--workers='):
+            workers = int(arg[len('--workers='):])
+
+    # compare all the annotations instead of only the ones which changed since the last sync
+    incremental = '--full-sync' not in argv[5:]
+
+    # only count the annotations that would be imported
+    dry_run = '--dry-run' in argv[5:]
+
+    sioyek = sioyek_factory(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH)
     document = sioyek.get_document(FILE_PATH)
-    document.import_annotations()
+    import_result = document.import_annotations(dry_run=dry_run, workers=workers, incremental=incremental)
+    sioyek.set_status_string(str(import_result))
     document.close()
     sioyek.reload()
     sioyek.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
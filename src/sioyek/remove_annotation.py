@@ -9,16 +9,19 @@ def parse_rect(s):
     return page, rect
 
 
-if __name__ == '__main__':
-    SIOYEK_PATH = clean_path(sys.argv[1])
-    LOCAL_DATABASE_PATH = clean_path(sys.argv[2])
-    SHARED_DATABASE_PATH = clean_path(sys.argv[3])
-    FILE_PATH = clean_path(sys.argv[4])
-    rect_string = sys.argv[5]
+def main(argv, sioyek_factory=Sioyek):
+    SIOYEK_PATH = clean_path(argv[1])
+    LOCAL_DATABASE_PATH = clean_path(argv[2])
+    SHARED_DATABASE_PATH = clean_path(argv[3])
+    FILE_PATH = clean_path(argv[4])
+    rect_string = argv[5]
 
-    sioyek = Sioyek(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH)
+    sioyek = sioyek_factory(SIOYEK_PATH, LOCAL_DATABASE_PATH, SHARED_DATABASE_PATH, read_only_databases=True)
     document = sioyek.get_document(FILE_PATH)
     selected_page, selected_rect = parse_rect(rect_string)
 
     document.remove_annotations(selected_page, selected_rect)
-    sioyek.reload()
\ No newline at end of file
+    sioyek.reload()
+
+if __name__ == '__main__':
+    main(sys.argv)
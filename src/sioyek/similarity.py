@@ -0,0 +1,154 @@
+'''
+Approximate string matching used to find sioyek highlights in the text of PDF pages and to check
+whether PDF annotations and sioyek annotations have the same text.
+
+The matching uses Myers' bit-parallel edit distance algorithm (with python integers as arbitrary
+length bit vectors), so finding the best approximate occurrence of a pattern in a text is a single
+pass over the text, regardless of how many errors the match has.
+'''
+
+from functools import lru_cache
+
+@lru_cache(maxsize=1024)
+def compile_pattern(pattern):
+    '''
+    Returns a dictionary mapping each character of the pattern to a bitmask of its positions.
+    '''
+    char_masks = dict()
+    for i, char in enumerate(pattern):
+        char_masks[char] = char_masks.get(char, 0) | (1 << i)
+    return char_masks
+
+def get_edit_distances(pattern, text, anchored=False):
+    '''
+    Yields the edit distance between the pattern and the best substring of the text ending at each text position.
+    If `anchored` is True, the substrings have to start at the beginning of the text (i.e. yields the edit distance
+    between the pattern and each prefix of the text).
+    '''
+    char_masks = compile_pattern(pattern)
+    pattern_length = len(pattern)
+    all_ones = (1 << pattern_length) - 1
+    last_bit = 1 << (pattern_length - 1)
+
+    positive_vertical = all_ones
+    negative_vertical = 0
+    score = pattern_length
+
+    for char in text:
+        equal = char_masks.get(char, 0)
+        x_vertical = equal | negative_vertical
+        x_horizontal = (((equal & positive_vertical) + positive_vertical) ^ positive_vertical) | equal
+        positive_horizontal = (negative_vertical | ~(x_horizontal | positive_vertical)) & all_ones
+        negative_horizontal = positive_vertical & x_horizontal
+
+        if positive_horizontal & last_bit:
+            score += 1
+        elif negative_horizontal & last_bit:
+            score -= 1
+
+        positive_horizontal = (positive_horizontal << 1) & all_ones
+        negative_horizontal = (negative_horizontal << 1) & all_ones
+        if anchored:
+            # the first row of the edit distance matrix increases by one in each column
+            positive_horizontal |= 1
+
+        positive_vertical = (negative_horizontal | ~(x_vertical | positive_horizontal)) & all_ones
+        negative_vertical = positive_horizontal & x_vertical
+
+        yield score
+
+def find_best_match(pattern, text, max_errors=None):
+    '''
+    Finds the substring of `text` with the lowest edit distance to `pattern`.
+    Returns a (begin, end, num_errors) tuple, where text[begin:end] is the matched substring, or None if
+    there is no match with at most `max_errors` errors.
+    '''
+    if len(pattern) == 0:
+        return None
+
+    best_errors = None
+    best_end = None
+    for i, errors in enumerate(get_edit_distances(pattern, text)):
+        if best_errors == None or errors < best_errors:
+            best_errors = errors
+            best_end = i + 1
+            if errors == 0:
+                break
+
+    if best_errors == None or (max_errors != None and best_errors > max_errors):
+        return None
+
+    # the match can not be longer than this, find where it begins by matching the reversed pattern
+    # against the reversed text which ends at `best_end`
+    search_begin = max(0, best_end - len(pattern) - best_errors)
+    reversed_text = text[search_begin:best_end][::-1]
+    for length, errors in enumerate(get_edit_distances(pattern[::-1], reversed_text, anchored=True), 1):
+        if errors == best_errors:
+            return best_end - length, best_end, best_errors
+
+    return best_end - len(reversed_text), best_end, best_errors
+
+def get_bounded_edit_distance(pattern, text, max_distance=None):
+    if max_distance != None and abs(len(pattern) - len(text)) > max_distance:
+        return max_distance + 1
+
+    distance = len(pattern)
+    if len(pattern) == 0:
+        distance = len(text)
+
+    if len(pattern) > 0:
+        for i, distance in enumerate(get_edit_distances(pattern, text, anchored=True)):
+            # each remaining character of the text can decrease the distance by at most one
+            remaining_chars = len(text) - i - 1
+            if max_distance != None and distance - remaining_chars > max_distance:
+                return max_distance + 1
+
+    if max_distance != None and distance > max_distance:
+        return max_distance + 1
+    return distance
+
+def levenshtein_distance(str1, str2, max_distance=None):
+    '''
+    Returns the edit distance between the two strings. If `max_distance` is given, we stop as soon as we know that
+    the distance is larger than `max_distance` and return `max_distance + 1`.
+    '''
+    # the running time is linear in the length of the text, so use the longer string as the pattern
+    if len(str1) >= len(str2):
+        return get_bounded_edit_distance(str1, str2, max_distance)
+    else:
+        return get_bounded_edit_distance(str2, str1, max_distance)
+
+def similarity_ratio(str1, str2):
+    '''
+    Returns a number between 0 (completely different) and 1 (equal).
+    '''
+    max_length = max(len(str1), len(str2))
+    if max_length == 0:
+        return 1.0
+    return 1.0 - levenshtein_distance(str1, str2) / max_length
+
+def normalize_text(text):
+    # PDF text extraction and sioyek don't agree on line breaks and spaces
+    return ''.join(text.split())
+
+def is_text_close(str1, str2, max_error_ratio=0.2):
+    '''
+    Checks if the strings are equal (ignoring whitespace) up to `max_error_ratio` errors per character.
+    '''
+    str1 = normalize_text(str1)
+    str2 = normalize_text(str2)
+    max_distance = int(max(len(str1), len(str2)) * max_error_ratio)
+    return levenshtein_distance(str1, str2, max_distance) <= max_distance
+
+def are_texts_close(text, candidates, max_error_ratio=0.2):
+    '''
+    Batch version of `is_text_close`, compares `text` against all the candidates and returns a list of booleans.
+    The bit masks of `text` are computed once and reused for all the candidates.
+    '''
+    text = normalize_text(text)
+    results = []
+    for candidate in candidates:
+        candidate = normalize_text(candidate)
+        max_distance = int(max(len(text), len(candidate)) * max_error_ratio)
+        results.append(get_bounded_edit_distance(text, candidate, max_distance) <= max_distance)
+    return results
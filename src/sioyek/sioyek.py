@@ -1,17 +1,24 @@
-from contextlib import redirect_stdout
+from contextlib import redirect_stdout, contextmanager
 from dataclasses import dataclass
-from functools import lru_cache
 import os
-import regex
-import sqlite3
 import subprocess
 import sys
 import math
-from collections import defaultdict
+import bisect
+import json
+import time
+import hashlib
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from PyQt5.QtNetwork import QLocalSocket
 from PyQt5.QtCore import QByteArray, QDataStream, QIODevice
 
 import fitz
+import numpy as np
+
+from .similarity import find_best_match, is_text_close, are_texts_close
+from . import database
 
 COLOR_MAP = {'a': (0.94, 0.64, 1.00),
             'b': (0.00, 0.46, 0.86),
@@ -41,6 +48,24 @@ COLOR_MAP = {'a': (0.94, 0.64, 1.00),
             'z': (1.00, 0.31, 0.02)
 }
 
+CACHE_DIRECTORY_NAME = 'python_extensions_cache'
+# size of the chunks in which files are read when hashing them
+HASH_CHUNK_SIZE = 1024 * 1024
+# maximum number of errors allowed when searching for highlight text in a page
+MAX_SELECTION_ERRORS = 9
+# maximum ratio of errors to text length for the texts of a PDF annotation and a sioyek annotation to be considered the same
+FUZZY_TEXT_MAX_ERROR_RATIO = 0.2
+# maximum vertical distance between a PDF annotation and a sioyek annotation for them to be considered the same
+SAME_ANNOTATION_MAX_DISTANCE = 50
+# default limits of the per-document page caches
+DEFAULT_PAGE_CACHE_MAX_PAGES = 64
+DEFAULT_PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# rough memory usage of the cached objects whose size we can't measure
+APPROXIMATE_PAGE_BYTES = 16 * 1024
+APPROXIMATE_ANNOTATION_BYTES = 1024
+APPROXIMATE_WORD_BYTES = 200
+# number of incremental revisions after which `Document.save_changes(compact=True)` rewrites the whole file
+COMPACT_MIN_REVISIONS = 10
 
 def color_distance(color1, color2):
     return sum([(x-y)**2 for (x,y) in zip(color1, color2)])
@@ -73,7 +98,7 @@ def get_pdf_highlight_text(pdf_highlight, page):
 
 def are_highlights_same(pdf_highlight, sioyek_highlight, pdf_highlight_text):
     sioyek_highlight_document_pos = sioyek_highlight.get_begin_document_pos()
-    return abs(sioyek_highlight_document_pos.offset_y - pdf_highlight.rect[1]) < 50 and is_text_close_fuzzy(pdf_highlight_text, sioyek_highlight.text)
+    return abs(sioyek_highlight_document_pos.offset_y - pdf_highlight.rect[1]) < SAME_ANNOTATION_MAX_DISTANCE and is_text_close_fuzzy(pdf_highlight_text, sioyek_highlight.text)
 
 def are_bookmarks_same(pdf_bookmark, sioyek_bookmark):
     pdf_bookmark_text = pdf_bookmark.info['content']
@@ -83,23 +108,26 @@ def are_bookmarks_same(pdf_bookmark, sioyek_bookmark):
 
 
 def is_text_close_fuzzy(str1, str2):
-    len1 = len(str1)
-    len2 = len(str2)
-    if max(len1, len2) < 10:
-        l = min(len(str1), len(str2))
-        num_errors = int(l * 0.2)
-        #todo: this is *extremely* slow, do something better, e.g. levenshtein distance
-        match1 = regex.search('(' + regex.escape(str1) + '){e<=' + str(num_errors) +'}', str2)
-        match2 = regex.search('(' + regex.escape(str1) + '){e<=' + str(num_errors) +'}', str1)
-        if match1 and match2:
-            return True
-        else:
-            return False
-    else:
-        # return True
-        ratio = min(len1 / len2, len2/ len1)
-        return ratio > 0.8
+    return is_text_close(str1, str2, max_error_ratio=FUZZY_TEXT_MAX_ERROR_RATIO)
+
+
+class VerticalIndex:
+    '''
+    Items sorted by a y coordinate, used to quickly find the items that are vertically close to a point.
+    '''
+
+    def __init__(self, items, ys):
+        order = sorted(range(len(items)), key=lambda i: ys[i])
+        self.items = [items[i] for i in order]
+        self.ys = [ys[i] for i in order]
 
+    def query(self, y, max_distance):
+        '''
+        Returns the items whose y coordinate is less than `max_distance` away from `y`.
+        '''
+        begin = bisect.bisect_right(self.ys, y - max_distance)
+        end = bisect.bisect_left(self.ys, y + max_distance)
+        return self.items[begin:end]
 
 def merge_rects(rects):
     '''
@@ -157,36 +185,61 @@ def get_bounding_box(rects):
         ur_y = max(ur_y, rect[3])
 
     return fitz.Rect(ll_x, ll_y, ur_x, ur_y)
+
+def serialize_command_params(params):
+    data = QByteArray()
+    data_stream = QDataStream(data, QIODevice.WriteOnly)
+    data_stream.writeInt(len(params))
+    for param in params:
+        data_stream.writeQString(param)
+    return data
+
 class Sioyek:
 
-    def __init__(self, sioyek_path, local_database_path=None, shared_database_path=None, force_binary=False):
+    def __init__(self, sioyek_path, local_database_path=None, shared_database_path=None, force_binary=False, read_only_databases=False):
         self.path = sioyek_path
         self.is_dummy_mode = False
 
         self.local_database = None
         self.shared_database = None
+        self.local_database_path = None
+        self.shared_database_path = None
         self.cached_path_hash_map = None
+        self.cached_normalized_path_hash_map = None
         self.highlight_embed_method = 'fitz'
         # run the binary sioyek command instead of using local sockets
         # it is much slower and is kept only for possible backward incompatibilities
         self.force_binary = force_binary
+        # addons which only read the databases open them in read only mode, so they never lock sioyek out
+        self.read_only_databases = read_only_databases
         self.connected = False
         self.socket = None
+        # serialized commands of the currently active `batch()`, if any
+        self.batch_data = None
 
         if not force_binary:
-            self.socket = QLocalSocket()
-            self.socket.connectToServer('sioyek')
-            if self.socket.waitForConnected(1000):
-                self.connected = True
+            self.connect_to_server()
 
         if local_database_path != None:
             self.local_database_path = local_database_path
-            self.local_database = sqlite3.connect(self.local_database_path)
+            self.local_database = database.connect(self.local_database_path, read_only=read_only_databases)
+            if not read_only_databases:
+                database.ensure_indexes(self.local_database, database.LOCAL_DATABASE_INDEXES)
 
         if shared_database_path != None:
             self.shared_database_path = shared_database_path
-            self.shared_database = sqlite3.connect(self.shared_database_path)
+            self.shared_database = database.connect(self.shared_database_path, read_only=read_only_databases)
+            if not read_only_databases:
+                database.ensure_indexes(self.shared_database, database.SHARED_DATABASE_INDEXES)
     
+    def connect_to_server(self):
+        self.socket = QLocalSocket()
+        self.socket.connectToServer('sioyek')
+        self.connected = self.socket.waitForConnected(1000)
+
+    def is_connected_to_server(self):
+        return self.socket != None and self.socket.state() == QLocalSocket.ConnectedState
+
     def should_use_local_socket(self):
         return (not self.force_binary) and (self.connected)
 
@@ -205,20 +258,55 @@ class Sioyek:
         '''
         self.is_dummy_mode = mode
     
+    def get_cache_path(self):
+        '''
+        Directory next to the sioyek databases where the extensions keep their caches, None if
+        we don't have the database paths.
+        '''
+        database_path = self.shared_database_path or self.local_database_path
+        if database_path == None:
+            return None
+        return os.path.join(os.path.dirname(os.path.abspath(database_path)), CACHE_DIRECTORY_NAME)
+    
     def get_path_hash_map(self):
 
         if self.cached_path_hash_map == None:
-            query = 'SELECT * from document_hash'
-            cursor = self.get_local_database().execute(query)
-            results = cursor.fetchall()
-            res = dict()
-            for _, path, hash_ in results:
-                res[path] = hash_
-            self.cached_path_hash_map = res
+            self.cached_path_hash_map = database.get_path_hash_map(self.get_local_database())
 
         return self.cached_path_hash_map
 
-    def run_command(self, command_name, text=None, focus=False):
+    def get_normalized_path_hash_map(self):
+        if self.cached_normalized_path_hash_map == None:
+            self.cached_normalized_path_hash_map = {os.path.normpath(path): hash_ for path, hash_ in self.get_path_hash_map().items()}
+        return self.cached_normalized_path_hash_map
+
+    def get_document_hash(self, path):
+        '''
+        Returns the hash that sioyek has stored for the document at `path` or None if sioyek has never opened it.
+        '''
+        candidate_paths = [path, path.replace('\\', '/'), os.path.normpath(path)]
+
+        for candidate_path in dict.fromkeys(candidate_paths):
+            document_hash = database.get_document_hash(self.get_local_database(), candidate_path)
+            if document_hash != None:
+                return document_hash
+
+        # the path is stored in a different (but equivalent) form
+        return self.get_normalized_path_hash_map().get(os.path.normpath(path))
+
+    def get_all_highlights(self):
+        '''
+        Returns a `HighlightSet` of the highlights of all the documents in the shared database.
+        '''
+        return HighlightSet.from_rows(database.iter_all_highlight_rows(self.get_shared_database()))
+
+    def get_all_bookmarks(self):
+        '''
+        Returns a `BookmarkSet` of the bookmarks of all the documents in the shared database.
+        '''
+        return BookmarkSet.from_rows(database.iter_all_bookmark_rows(self.get_shared_database()))
+
+    def get_command_params(self, command_name, text=None, focus=False):
         if text == None:
             params = [self.path, '--execute-command', command_name]
         else:
@@ -226,23 +314,69 @@ class Sioyek:
         
         if focus == False:
             params.append('--nofocus')
+        return params
+
+    def write_to_socket(self, data):
+        self.socket.write(data)
+        self.socket.flush()
+        self.socket.waitForBytesWritten(1000)
+
+    def run_command(self, command_name, text=None, focus=False):
+        params = self.get_command_params(command_name, text, focus)
         
         if self.is_dummy_mode:
             print('dummy mode, executing: ', params)
         else:
             if self.should_use_local_socket():
-                data = QByteArray()
-                data_stream = QDataStream(data, QIODevice.WriteOnly)
-                data_stream.writeInt(len(params))
-                for param in params:
-                    data_stream.writeQString(param)
-                self.socket.write(data)
-                self.socket.flush()
-                self.socket.waitForBytesWritten(1000)
+                data = serialize_command_params(params)
+                if self.batch_data is not None:
+                    self.batch_data.append(data)
+                else:
+                    self.write_to_socket(data)
                 
             else:
                 subprocess.run(params)
 
+    @contextmanager
+    def batch(self):
+        '''
+        Buffer all the commands that are run inside the `with` block and send them to sioyek in a single write
+        when the block exits, for example:
+
+            with sioyek.batch():
+                for highlight in highlights:
+                    sioyek.keyboard_select(highlight)
+                    sioyek.add_highlight('a')
+
+        Commands are only buffered when we are connected to sioyek using the local socket, otherwise they are
+        executed immediately. Nested batches are sent when the outermost batch exits.
+        '''
+        # note that we can't use `!= None` here, an empty QByteArray compares equal to None
+        if self.batch_data is not None:
+            yield self
+            return
+
+        self.batch_data = QByteArray()
+        try:
+            yield self
+        finally:
+            data = self.batch_data
+            self.batch_data = None
+            if data.size() > 0:
+                self.write_to_socket(data)
+
+    def run_commands(self, commands, focus=False):
+        '''
+        Run a list of commands in a single batch. Each command is either a command name or a (command_name, text) tuple.
+        '''
+        with self.batch():
+            for command in commands:
+                if isinstance(command, str):
+                    self.run_command(command, None, focus=focus)
+                else:
+                    command_name, text = command
+                    self.run_command(command_name, text, focus=focus)
+
     def goto_begining(self, focus=False):
         self.run_command("goto_begining", None, focus=focus)
 
@@ -643,8 +777,10 @@ class Sioyek:
         return Document(path, self)
     
     def close(self):
-        self.local_database.close()
-        self.shared_database.close()
+        if self.local_database != None:
+            self.local_database.close()
+        if self.shared_database != None:
+            self.shared_database.close()
 
 
     def statusbar_output(self):
@@ -670,8 +806,44 @@ class AbsoluteDocumentPos:
     offset_x: float
     offset_y: float
 
+@dataclass
+class ImportResult:
+    num_highlights: int
+    num_bookmarks: int
+    # time it took to find the annotations that are not in the database
+    diff_seconds: float
+    # time it took to write the annotations into the database
+    write_seconds: float
+    dry_run: bool = False
+    # why nothing was imported
+    error: str = None
+
+    def num_rows(self):
+        return self.num_highlights + self.num_bookmarks
+
+    def rows_per_second(self):
+        if self.write_seconds == 0:
+            return 0
+        return self.num_rows() / self.write_seconds
+
+    def __str__(self):
+        if self.error != None:
+            return self.error
+        if self.dry_run:
+            return f"{self.num_highlights} highlights and {self.num_bookmarks} bookmarks would be imported"
+        return f"imported {self.num_highlights} highlights and {self.num_bookmarks} bookmarks ({self.rows_per_second():.0f} rows/s)"
+
+def check_document_hash(document_hash, document):
+    '''
+    Raises a ValueError if the document is not in the sioyek database. The database rows are keyed by the document
+    hash, so rows without it wouldn't belong to any document.
+    '''
+    if document_hash == None:
+        raise ValueError('{} is not in the sioyek database, open it in sioyek first'.format(document.path))
 
 class Highlight:
+    # there can be a lot of highlights in a document, don't give each of them a __dict__
+    __slots__ = ('doc', 'text', 'highlight_type', 'selection_begin', 'selection_end')
 
     def __init__(self, document, text, highlight_type, begin, end):
         self.doc = document
@@ -681,15 +853,14 @@ class Highlight:
         self.selection_end = end
 
     def insert(self, document):
-        INSERT_QUERY = "INSERT INTO highlights (document_path, desc, type, begin_x, begin_y, end_x, end_y) VALUES (?, ?, ?, ?, ?, ?, ?)"
-        path_hash_map = document.sioyek.get_path_hash_map()
-        document_hash = path_hash_map[document.path.replace('\\', '/')]
+        document_hash = document.get_hash()
+        database.insert_highlight_rows(self.doc.sioyek.get_shared_database(), [self.get_insert_params(document_hash)])
 
+    def get_insert_params(self, document_hash):
+        check_document_hash(document_hash, self.doc)
         begin_abs_pos = self.get_begin_abs_pos()
         end_abs_pos = self.get_end_abs_pos()
-
-        cursor = self.doc.sioyek.shared_database.cursor()
-        cursor.execute(INSERT_QUERY, (
+        return (
             document_hash,
             self.text,
             self.highlight_type,
@@ -697,8 +868,7 @@ class Highlight:
             begin_abs_pos.offset_y,
             end_abs_pos.offset_x,
             end_abs_pos.offset_y
-        ))
-        cursor.close()
+        )
 
     
     def get_begin_document_pos(self):
@@ -720,6 +890,7 @@ class Highlight:
         return f"Highlight of type {self.highlight_type}: {self.text}"
 
 class Bookmark:
+    __slots__ = ('doc', 'description', 'y_offset')
 
     def __init__(self, document, description, y_offset):
         self.doc = document
@@ -727,15 +898,13 @@ class Bookmark:
         self.y_offset = y_offset
 
     def insert(self, document):
-        INSERT_QUERY = "INSERT INTO bookmarks (document_path, desc, offset_y) VALUES (?, ?, ?)"
-        path_hash_map = document.sioyek.get_path_hash_map()
-        document_hash = path_hash_map[document.path.replace('\\', '/')]
+        document_hash = document.get_hash()
+        database.insert_bookmark_rows(self.doc.sioyek.get_shared_database(), [self.get_insert_params(document_hash)])
 
-        cursor = self.doc.sioyek.shared_database.cursor()
-        cursor.execute(INSERT_QUERY, (document_hash, self.description, self.y_offset))
-        cursor.close()
+    def get_insert_params(self, document_hash):
+        check_document_hash(document_hash, self.doc)
+        return (document_hash, self.description, self.y_offset)
     
-    @lru_cache(maxsize=None)
     def get_document_position(self):
         return self.doc.absolute_to_document_y(self.y_offset)
     
@@ -743,62 +912,776 @@ class Bookmark:
     def __repr__(self):
         return f"Bookmark at {self.y_offset}: {self.description}"
 
+def get_type_code(highlight_type):
+    if highlight_type == None or len(highlight_type) == 0:
+        return 0
+    return ord(highlight_type[0])
+
+class AnnotationSet:
+    '''
+    Base class of the columnar annotation collections. The annotations of each document are identified by
+    an index into `document_hashes`, so the (long) hash strings are stored once per document.
+    '''
+
+    def __init__(self, document_hashes, document_indices, document=None):
+        self.document_hashes = document_hashes
+        self.document_indices = document_indices
+        # the document that `Highlight`/`Bookmark` views of the annotations refer to, None for
+        # sets which contain annotations of many documents
+        self.document = document
+
+    def __len__(self):
+        return len(self.document_indices)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_document_hash(self, index):
+        return self.document_hashes[self.document_indices[index]]
+
+    def get_document_mask(self, document_hash):
+        if document_hash not in self.document_hashes:
+            return np.zeros(len(self), dtype=bool)
+        return self.document_indices == self.document_hashes.index(document_hash)
+
+    def count_by_document(self):
+        counts = np.bincount(self.document_indices, minlength=len(self.document_hashes))
+        return {document_hash: int(count) for document_hash, count in zip(self.document_hashes, counts) if count > 0}
+
+    def for_document(self, document_hash, document=None):
+        return self.select(self.get_document_mask(document_hash), document=document)
+
+class HighlightSet(AnnotationSet):
+    '''
+    Highlights stored as columns: numpy arrays of the coordinates and type codes (`ord` of the highlight type)
+    and a list of the texts. Indexing the set returns a `Highlight` view of a single highlight.
+    '''
+
+    def __init__(self, document_hashes, document_indices, texts, type_codes, begin_x, begin_y, end_x, end_y, document=None):
+        super().__init__(document_hashes, document_indices, document)
+        self.texts = texts
+        self.type_codes = type_codes
+        self.begin_x = begin_x
+        self.begin_y = begin_y
+        self.end_x = end_x
+        self.end_y = end_y
+
+    @staticmethod
+    def from_rows(rows, document=None):
+        '''
+        Creates the set from (document_hash, text, type, begin_x, begin_y, end_x, end_y) rows, `rows` can be a cursor.
+        '''
+        hash_indices = dict()
+        document_indices = []
+        texts = []
+        type_codes = []
+        coordinates = []
+        for document_hash, text, highlight_type, begin_x, begin_y, end_x, end_y in rows:
+            document_indices.append(hash_indices.setdefault(document_hash, len(hash_indices)))
+            texts.append(text)
+            type_codes.append(get_type_code(highlight_type))
+            coordinates.append((begin_x, begin_y, end_x, end_y))
+
+        coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 4)
+        return HighlightSet(
+            list(hash_indices.keys()),
+            np.array(document_indices, dtype=np.int32),
+            texts,
+            np.array(type_codes, dtype=np.uint8),
+            coordinates[:, 0].copy(),
+            coordinates[:, 1].copy(),
+            coordinates[:, 2].copy(),
+            coordinates[:, 3].copy(),
+            document=document)
+
+    def select(self, mask_or_indices, document=None):
+        indices = np.arange(len(self))[mask_or_indices]
+        return HighlightSet(
+            self.document_hashes,
+            self.document_indices[indices],
+            [self.texts[i] for i in indices],
+            self.type_codes[indices],
+            self.begin_x[indices],
+            self.begin_y[indices],
+            self.end_x[indices],
+            self.end_y[indices],
+            document=document or self.document)
+
+    def get_type(self, index):
+        code = self.type_codes[index]
+        return chr(code) if code > 0 else ''
+
+    def get_type_mask(self, highlight_type):
+        return self.type_codes == get_type_code(highlight_type)
+
+    def count_by_type(self):
+        codes, counts = np.unique(self.type_codes, return_counts=True)
+        return {(chr(code) if code > 0 else ''): int(count) for code, count in zip(codes, counts)}
+
+    def get_begin_pages(self):
+        '''
+        Page numbers of the beginning of the highlights in `self.document`.
+        '''
+        pages, _ = self.document.absolute_to_document_y_batch(self.begin_y)
+        return pages
+
+    def __getitem__(self, index):
+        return Highlight(
+            self.document,
+            self.texts[index],
+            self.get_type(index),
+            (float(self.begin_x[index]), float(self.begin_y[index])),
+            (float(self.end_x[index]), float(self.end_y[index])))
+
+class BookmarkSet(AnnotationSet):
+    '''
+    Bookmarks stored as columns, see `HighlightSet`.
+    '''
+
+    def __init__(self, document_hashes, document_indices, descriptions, offset_y, document=None):
+        super().__init__(document_hashes, document_indices, document)
+        self.descriptions = descriptions
+        self.offset_y = offset_y
+
+    @staticmethod
+    def from_rows(rows, document=None):
+        '''
+        Creates the set from (document_hash, description, offset_y) rows, `rows` can be a cursor.
+        '''
+        hash_indices = dict()
+        document_indices = []
+        descriptions = []
+        offsets = []
+        for document_hash, description, offset_y in rows:
+            document_indices.append(hash_indices.setdefault(document_hash, len(hash_indices)))
+            descriptions.append(description)
+            offsets.append(offset_y)
+
+        return BookmarkSet(
+            list(hash_indices.keys()),
+            np.array(document_indices, dtype=np.int32),
+            descriptions,
+            np.array(offsets, dtype=np.float64),
+            document=document)
+
+    def select(self, mask_or_indices, document=None):
+        indices = np.arange(len(self))[mask_or_indices]
+        return BookmarkSet(
+            self.document_hashes,
+            self.document_indices[indices],
+            [self.descriptions[i] for i in indices],
+            self.offset_y[indices],
+            document=document or self.document)
+
+    def get_pages(self):
+        '''
+        Page numbers of the bookmarks in `self.document`.
+        '''
+        pages, _ = self.document.absolute_to_document_y_batch(self.offset_y)
+        return pages
+
+    def __getitem__(self, index):
+        return Bookmark(self.document, self.descriptions[index], float(self.offset_y[index]))
+
+class WordIndex:
+    '''
+    Uniform grid over the word rects of a page, used to find the word closest to a point with the same rules
+    as `get_closest_rect_to_point` (a word containing the point is closest, otherwise the word with the closest
+    center, ties are broken by the lower word index) by only looking at the grid cells around the point.
+    '''
+
+    def __init__(self, word_boxes):
+        self.boxes = np.asarray(word_boxes, dtype=np.float64).reshape(-1, 4)
+        self.centers = np.stack([(self.boxes[:, 0] + self.boxes[:, 2]) / 2, (self.boxes[:, 1] + self.boxes[:, 3]) / 2], axis=1)
+        # word indices whose centers are in each cell, and whose rects overlap each cell
+        self.center_cells = defaultdict(list)
+        self.rect_cells = defaultdict(list)
+
+        if len(self.boxes) == 0:
+            return
+
+        # cells about the size of a line of text, so that each cell contains a few words
+        heights = self.boxes[:, 3] - self.boxes[:, 1]
+        self.cell_size = max(float(np.median(heights)) * 2, 1.0)
+        self.origin = self.boxes[:, :2].min(axis=0)
+
+        center_cells = self.get_cells(self.centers)
+        begin_cells = self.get_cells(self.boxes[:, :2])
+        end_cells = self.get_cells(self.boxes[:, 2:])
+        self.num_cells = center_cells.max(axis=0) + 1
+
+        for i in range(len(self.boxes)):
+            self.center_cells[(center_cells[i, 0], center_cells[i, 1])].append(i)
+            for cell_x in range(begin_cells[i, 0], end_cells[i, 0] + 1):
+                for cell_y in range(begin_cells[i, 1], end_cells[i, 1] + 1):
+                    self.rect_cells[(cell_x, cell_y)].append(i)
+
+    def get_cells(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def get_approximate_size(self):
+        return self.boxes.nbytes + self.centers.nbytes + 16 * (len(self.boxes) + sum(len(cell) for cell in self.rect_cells.values()))
+
+    def find_containing_word(self, point):
+        cell_x, cell_y = self.get_cells(np.array(point, dtype=np.float64))
+        for i in self.rect_cells.get((cell_x, cell_y), []):
+            x0, y0, x1, y1 = self.boxes[i]
+            # same as `fitz.Rect.contains` for points
+            if x0 <= point[0] < x1 and y0 <= point[1] < y1:
+                return i
+        return None
+
+    def find_nearest_center(self, point):
+        '''
+        Returns the (distance, index) of the word whose center is closest to the point.
+        '''
+        point = np.array(point, dtype=np.float64)
+        cell_x, cell_y = self.get_cells(point)
+        max_ring = max(abs(cell_x), abs(cell_x - self.num_cells[0] + 1), abs(cell_y), abs(cell_y - self.num_cells[1] + 1))
+
+        best = None
+        for ring in range(max_ring + 1):
+            # the point can be anywhere in its cell, so the centers in this ring (and the next ones)
+            # are at least `ring - 1` cells away from it
+            if best != None and best[0] < (ring - 1) * self.cell_size:
+                break
+
+            for ring_cell in get_ring_cells(cell_x, cell_y, ring):
+                indices = self.center_cells.get(ring_cell)
+                if indices == None:
+                    continue
+                distances = np.sqrt(((self.centers[indices] - point) ** 2).sum(axis=1))
+                i = int(np.argmin(distances))
+                candidate = (float(distances[i]), indices[i])
+                if best == None or candidate < best:
+                    best = candidate
+        return best
+
+    def find_closest_word(self, point):
+        '''
+        Returns the index of the word closest to the point or None if there are no words.
+        '''
+        if len(self.boxes) == 0:
+            return None
+
+        containing_word = self.find_containing_word(point)
+        nearest_distance, nearest_word = self.find_nearest_center(point)
+        if containing_word == None:
+            return nearest_word
+        if nearest_distance == 0 and nearest_word < containing_word:
+            return nearest_word
+        return containing_word
+
+    def get_selection(self, begin_point, end_point):
+        '''
+        Returns the range of the indices of the words selected from `begin_point` to `end_point`.
+        '''
+        begin_word = self.find_closest_word(begin_point)
+        end_word = self.find_closest_word(end_point)
+        if begin_word == None:
+            return range(0)
+        if begin_word <= end_word:
+            return range(begin_word, end_word + 1)
+        # the selection is not closed, it continues to the end of the page
+        return range(begin_word, len(self.boxes))
+
+def get_ring_cells(center_x, center_y, ring):
+    '''
+    Yields the grid cells whose chebyshev distance from the center cell is `ring`.
+    '''
+    if ring == 0:
+        yield (center_x, center_y)
+        return
+
+    for x in range(center_x - ring, center_x + ring + 1):
+        yield (x, center_y - ring)
+        yield (x, center_y + ring)
+    for y in range(center_y - ring + 1, center_y + ring):
+        yield (center_x - ring, y)
+        yield (center_x + ring, y)
+
+class PageTextLayer:
+    '''
+    The text of a page (as a single string) along with the bounding boxes of its words. It is computed once per page
+    and shared by all the text searches on that page.
+    '''
+
+    def __init__(self, word_data):
+        self.word_data = word_data
+        self.word_texts = []
+        self.word_boxes = np.zeros((len(word_data), 4), dtype=np.float32)
+
+        string_parts = []
+        part_lengths = []
+
+        for i in range(len(word_data)):
+            word_text = word_data[i][4]
+            block_no = word_data[i][5]
+            if i > 0:
+                if block_no != word_data[i-1][5]:
+                    word_text = word_text + '\n'
+            self.word_texts.append(word_text)
+            self.word_boxes[i] = word_data[i][0:4]
+
+            additional_string = word_text
+
+            if word_text[-1] != '\n':
+                additional_string += ' '
+
+            string_parts.append(additional_string)
+            part_lengths.append(len(additional_string))
+
+        self.text = ''.join(string_parts)
+        # index of the word that each character of `self.text` belongs to
+        self.char_to_word = np.repeat(np.arange(len(word_data), dtype=np.int32), part_lengths)
+
+    def get_approximate_size(self):
+        return self.word_boxes.nbytes + self.char_to_word.nbytes + 2 * len(self.text) + APPROXIMATE_WORD_BYTES * len(self.word_data)
+
+    def get_word_rects(self, word_indices):
+        return [fitz.Rect(self.word_boxes[i].tolist()) for i in word_indices]
+
+    def get_text_in_rects(self, rects):
+        '''
+        Returns the text of the words whose centers are inside any of the rects.
+        '''
+        if len(self.word_data) == 0 or len(rects) == 0:
+            return ''
+
+        centers_x = (self.word_boxes[:, 0] + self.word_boxes[:, 2]) / 2
+        centers_y = (self.word_boxes[:, 1] + self.word_boxes[:, 3]) / 2
+        inside = np.zeros(len(self.word_data), dtype=bool)
+        for rect in rects:
+            inside |= (centers_x >= rect[0]) & (centers_x <= rect[2]) & (centers_y >= rect[1]) & (centers_y <= rect[3])
+        return ' '.join(self.word_data[i][4] for i in np.flatnonzero(inside))
+
+    def get_span_rects(self, begin, end):
+        '''
+        Returns the rects of the words that the characters in range [begin, end) of the text belong to.
+        '''
+        # char_to_word is sorted, so np.unique keeps the order of the words
+        return self.get_word_rects(np.unique(self.char_to_word[begin:end]))
+
+def get_file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def read_json_file(path):
+    '''
+    Returns the contents of a JSON cache file or None if it doesn't exist or is corrupted.
+    '''
+    if path == None or (not os.path.exists(path)):
+        return None
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+def write_json_file(path, data):
+    '''
+    Atomically replaces the JSON cache file, failures are ignored since the caches are just an optimization.
+    '''
+    if path == None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+def md5_hash(file_path):
+    '''
+    md5 hash of the file contents, which is how sioyek identifies documents.
+    '''
+    file_hash = hashlib.md5()
+
+    with open(file_path, "rb") as f:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = f.read(HASH_CHUNK_SIZE)
+
+    return file_hash.hexdigest()
+
+class PageGeometry:
+    '''
+    Page dimensions of a document. The dimensions are read from the page tree (without loading the pages)
+    only when they are needed, so operations that only touch the first few pages don't have to go through
+    the whole document.
+    '''
+
+    def __init__(self, doc, get_cache_file_path=None, file_stamp=None):
+        self.doc = doc
+        self.page_count = doc.page_count
+        self.page_widths = []
+        self.page_heights = []
+        # cum_page_heights[i] is the absolute offset of the top of page i, it has an additional
+        # element at the end which is the total height of the loaded pages
+        self.cum_page_heights = [0]
+        self.cum_page_heights_array = None
+
+        # a function returning the path of the on-disk cache of the dimensions (or None), it is only
+        # called when we actually need the dimensions since it requires the document hash
+        self.get_cache_file_path = get_cache_file_path
+        self.cache_file_path = None
+        # the cache is only valid for this exact version of the file
+        self.file_stamp = file_stamp
+        self.tried_cache = get_cache_file_path == None
+
+    def num_loaded_pages(self):
+        return len(self.page_heights)
+
+    def is_complete(self):
+        return self.num_loaded_pages() == self.page_count
+
+    def set_dimensions(self, page_widths, page_heights):
+        self.page_widths = list(page_widths)
+        self.page_heights = list(page_heights)
+        self.cum_page_heights = [0]
+        for height in self.page_heights:
+            self.cum_page_heights.append(self.cum_page_heights[-1] + height)
+        self.cum_page_heights_array = None
+
+    def load_cache(self):
+        self.tried_cache = True
+        self.cache_file_path = self.get_cache_file_path()
+        cache = read_json_file(self.cache_file_path)
+        if cache == None:
+            return
+
+        if cache.get('file_stamp') != list(self.file_stamp) or len(cache.get('page_heights', [])) != self.page_count:
+            return
+        self.set_dimensions(cache['page_widths'], cache['page_heights'])
+
+    def write_cache(self):
+        if self.cache_file_path == None:
+            return
+
+        cache = {
+            'file_stamp': list(self.file_stamp),
+            'page_widths': self.page_widths,
+            'page_heights': self.page_heights,
+        }
+        write_json_file(self.cache_file_path, cache)
+
+    def load_next_page(self):
+        if not self.tried_cache:
+            self.load_cache()
+            if self.is_complete():
+                return
+
+        page_number = self.num_loaded_pages()
+        # can't simply use the page's mediabox because some documents have non-zero origin
+        # see https://github.com/ahrm/sioyek-python-extensions/issues/2#issuecomment-1578255778 
+        if self.doc.is_pdf:
+            # doesn't load the page
+            cropbox = self.doc.page_cropbox(page_number)
+        else:
+            # page_cropbox only works for PDF files, but sioyek also opens EPUB, XPS, etc.
+            cropbox = self.doc.load_page(page_number).cropbox
+        width = cropbox[2] - cropbox[0]
+        height = cropbox[3] - cropbox[1]
+
+        self.page_widths.append(width)
+        self.page_heights.append(height)
+        self.cum_page_heights.append(self.cum_page_heights[-1] + height)
+        self.cum_page_heights_array = None
+
+        if self.is_complete():
+            self.write_cache()
+
+    def load_until_page(self, page_number):
+        page_number = min(page_number, self.page_count - 1)
+        while self.num_loaded_pages() <= page_number:
+            self.load_next_page()
+
+    def load_until_offset(self, offset_y):
+        self.load_until_page(0)
+        while (not self.is_complete()) and self.cum_page_heights[-1] < offset_y:
+            self.load_next_page()
+
+    def load_all(self):
+        self.load_until_page(self.page_count - 1)
+
+    def get_page_width(self, page_number):
+        self.load_until_page(page_number)
+        return self.page_widths[page_number]
+
+    def get_page_height(self, page_number):
+        self.load_until_page(page_number)
+        return self.page_heights[page_number]
+
+    def get_page_top(self, page_number):
+        self.load_until_page(page_number)
+        return self.cum_page_heights[page_number]
+
+    def get_page_tops_array(self):
+        if self.cum_page_heights_array is None:
+            self.cum_page_heights_array = np.array(self.cum_page_heights[:-1], dtype=np.float64)
+        return self.cum_page_heights_array
+
+    def absolute_to_document_y(self, offset_y):
+        self.load_until_offset(offset_y)
+        num_pages = self.num_loaded_pages()
+        # offsets that are exactly on the boundary of two pages belong to the first page
+        page = bisect.bisect_left(self.cum_page_heights, offset_y, 0, num_pages) - 1
+        page = min(max(page, 0), num_pages - 1)
+        return (page, offset_y - self.cum_page_heights[page])
+
+    def absolute_to_document_y_batch(self, offsets_y):
+        offsets_y = np.asarray(offsets_y, dtype=np.float64)
+        if offsets_y.size > 0:
+            self.load_until_offset(offsets_y.max())
+        else:
+            self.load_until_page(0)
+
+        page_tops = self.get_page_tops_array()
+        pages = np.searchsorted(page_tops, offsets_y, side='left') - 1
+        pages = np.clip(pages, 0, page_tops.size - 1)
+        return pages, offsets_y - page_tops[pages]
+
+def get_approximate_size(value):
+    if hasattr(value, 'get_approximate_size'):
+        return value.get_approximate_size()
+    if isinstance(value, fitz.Page):
+        return APPROXIMATE_PAGE_BYTES
+    if isinstance(value, VerticalIndex):
+        return APPROXIMATE_ANNOTATION_BYTES * len(value.items)
+    if isinstance(value, list):
+        return APPROXIMATE_ANNOTATION_BYTES * len(value)
+    return 0
+
+class PageCacheEntry:
+    __slots__ = ('values', 'size')
+
+    def __init__(self):
+        # the page and the values computed from it (annotations, text layer, etc.) keyed by name
+        self.values = dict()
+        self.size = 0
+
+class PageCache:
+    '''
+    LRU cache of the pages of a document and the values computed from them. All the values of a page are
+    evicted together with the page, so no annotation or text layer keeps an evicted page alive.
+    The cache is limited both by the number of pages and by the (approximate) total size of the cached values.
+    '''
+
+    def __init__(self, max_pages=DEFAULT_PAGE_CACHE_MAX_PAGES, max_bytes=DEFAULT_PAGE_CACHE_MAX_BYTES):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, page_number, key, compute):
+        '''
+        Returns the value named `key` of the page, calling `compute()` if it is not cached.
+        '''
+        entry = self.entries.get(page_number)
+        if entry != None:
+            self.entries.move_to_end(page_number)
+            if key in entry.values:
+                self.hits += 1
+                return entry.values[key]
+
+        self.misses += 1
+        value = compute()
+
+        # `compute` may have added the entry (e.g. by loading the page)
+        entry = self.entries.get(page_number)
+        if entry == None:
+            entry = PageCacheEntry()
+            self.entries[page_number] = entry
+
+        size = get_approximate_size(value)
+        entry.values[key] = value
+        entry.size += size
+        self.total_size += size
+        self.evict()
+        return value
+
+    def evict(self):
+        # never evict the most recently used page, it is the one we are returning values of
+        while len(self.entries) > 1 and (len(self.entries) > self.max_pages or (self.max_bytes != None and self.total_size > self.max_bytes)):
+            _, entry = self.entries.popitem(last=False)
+            self.total_size -= entry.size
+            self.evictions += 1
+
+    def invalidate(self, page_number=None, keys=None):
+        '''
+        Removes the values named `keys` (all the values if `keys` is None) of the page (of all pages if `page_number` is None).
+        '''
+        page_numbers = list(self.entries.keys()) if page_number == None else [page_number]
+        for number in page_numbers:
+            entry = self.entries.get(number)
+            if entry == None:
+                continue
+
+            if keys == None:
+                del self.entries[number]
+                self.total_size -= entry.size
+                continue
+
+            for key in keys:
+                if key in entry.values:
+                    size = get_approximate_size(entry.values.pop(key))
+                    entry.size -= size
+                    self.total_size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.total_size = 0
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'pages': len(self.entries),
+            'approximate_bytes': self.total_size,
+        }
+
+class SyncState:
+    '''
+    What the previous syncs have already reconciled between the sioyek database and the PDF file of a document,
+    so that the next sync only has to look at the new database rows and the changed pages. The 'embed' and 'import'
+    sections are independent and are None until the first sync of that kind.
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.sections = read_json_file(file_path) or dict()
+
+    def get(self, section):
+        return self.sections.get(section)
+
+    def set(self, section, value):
+        self.sections[section] = value
+        write_json_file(self.file_path, self.sections)
+
+# page cache values which become stale when annotations are added to or removed from the page
+ANNOTATION_CACHE_KEYS = ['pdf_annotations', 'pdf_bookmarks', 'pdf_highlights', 'pdf_highlight_index']
+
 class Document:
 
-    def __init__(self, path, sioyek):
+    def __init__(self, path, sioyek, max_cached_pages=DEFAULT_PAGE_CACHE_MAX_PAGES, max_cached_bytes=DEFAULT_PAGE_CACHE_MAX_BYTES):
         self.path = path
         self.doc = fitz.open(self.path)
-        self.set_page_dimensions()
         self.sioyek = sioyek
         self.cached_hash = None
+        self.page_cache = PageCache(max_cached_pages, max_cached_bytes)
+        # number of nested `edit_session`s and whether they have edits that are not saved yet
+        self.edit_session_depth = 0
+        self.has_deferred_changes = False
+        # whether a block of the current (outermost) `edit_session` raised an exception
+        self.edit_session_failed = False
+        # whether the document was changed since it was last saved, fitz's `is_dirty` stays True after `saveIncr`
+        self.has_unsaved_changes = False
+        # fitz only counts the revisions when the file is opened
+        self.revision_count = self.doc.version_count
+        self.set_page_dimensions()
+
+    @property
+    def page_widths(self):
+        self.page_geometry.load_all()
+        return self.page_geometry.page_widths
+
+    @property
+    def page_heights(self):
+        self.page_geometry.load_all()
+        return self.page_geometry.page_heights
+
+    @property
+    def cum_page_heights(self):
+        self.page_geometry.load_all()
+        return self.page_geometry.cum_page_heights[:-1]
 
     def to_absolute(self, document_pos):
         offset_x = document_pos.offset_x
-        offset_y = document_pos.offset_y + self.cum_page_heights[document_pos.page]
+        offset_y = document_pos.offset_y + self.page_geometry.get_page_top(document_pos.page)
         return AbsoluteDocumentPos(offset_x, offset_y)
         
 
     def absolute_to_document_y(self, offset_y):
-        page = 0
-        while offset_y > self.page_heights[page]:
-            offset_y -= self.page_heights[page]
-            page += 1
-        return (page, offset_y)
+        return self.page_geometry.absolute_to_document_y(offset_y)
+
+    def absolute_to_document_y_batch(self, offsets_y):
+        '''
+        Vectorized version of `absolute_to_document_y`, returns an array of pages and an array of offsets.
+        '''
+        return self.page_geometry.absolute_to_document_y_batch(offsets_y)
 
     def to_document(self, absolute_document_pos, pypdf=False):
         page, offset_y = self.absolute_to_document_y(absolute_document_pos.offset_y)
         if pypdf:
-            return DocumentPos(page, absolute_document_pos.offset_x + self.page_widths[page] / 2, offset_y)
+            return DocumentPos(page, absolute_document_pos.offset_x + self.page_geometry.get_page_width(page) / 2, offset_y)
         else:
             return DocumentPos(page, absolute_document_pos.offset_x, offset_y)
 
     
-    @lru_cache(maxsize=None)
     def get_page(self, page_number):
-        return self.doc.load_page(page_number)
+        return self.page_cache.get(page_number, 'page', lambda: self.doc.load_page(page_number))
     
-    @lru_cache(maxsize=None)
     def get_page_pdf_annotations(self, page_number):
-        page = self.get_page(page_number)
-        res = []
-        annot = page.first_annot
-        while annot != None:
-            res.append(annot)
-            annot = annot.next
+        def load_annotations():
+            page = self.get_page(page_number)
+            res = []
+            annot = page.first_annot
+            while annot != None:
+                res.append(annot)
+                annot = annot.next
+            return res
 
-        return res
+        return self.page_cache.get(page_number, 'pdf_annotations', load_annotations)
 
-    @lru_cache(maxsize=None)
     def get_page_pdf_bookmarks(self, page_number):
         def is_bookmark(annot):
             return annot.type[1] in ['Text', 'FreeText']
-        return [annot for annot in self.get_page_pdf_annotations(page_number) if is_bookmark(annot)]
+        return self.page_cache.get(page_number, 'pdf_bookmarks',
+                                   lambda: [annot for annot in self.get_page_pdf_annotations(page_number) if is_bookmark(annot)])
 
-    @lru_cache(maxsize=None)
     def get_page_pdf_highlights(self, page_number):
         def is_highlight(annot):
             return annot.type[1] == 'Highlight'
-        return [annot for annot in self.get_page_pdf_annotations(page_number) if is_highlight(annot)]
+        return self.page_cache.get(page_number, 'pdf_highlights',
+                                   lambda: [annot for annot in self.get_page_pdf_annotations(page_number) if is_highlight(annot)])
+
+    def get_page_pdf_highlight_index(self, page_number):
+        '''
+        Index of the (highlight, highlight_text) pairs of the page by the highlight's top y coordinate.
+        '''
+        def create_index():
+            highlights = self.get_page_pdf_highlights(page_number)
+            items = [(highlight, self.get_pdf_highlight_text(page_number, highlight)) for highlight in highlights]
+            return VerticalIndex(items, [highlight.rect[1] for highlight in highlights])
+
+        return self.page_cache.get(page_number, 'pdf_highlight_index', create_index)
+
+    def invalidate_page_annotations(self, page_number):
+        # this is called whenever an annotation of the page is added or removed
+        self.page_cache.invalidate(page_number, ANNOTATION_CACHE_KEYS)
+        self.has_unsaved_changes = True
+
+    def get_page_cache_stats(self):
+        return self.page_cache.get_stats()
+
+    def get_pdf_highlight_text(self, page_number, pdf_highlight):
+        '''
+        Text of the words covered by the quads of the highlight annotation. Unlike `get_pdf_highlight_text` this doesn't
+        include the rest of the lines that the highlight starts and ends in.
+        '''
+        vertices = pdf_highlight.vertices
+        if not vertices or len(vertices) % 4 != 0:
+            return get_pdf_highlight_text(pdf_highlight, self.get_page(page_number))
+        quad_rects = [fitz.Quad(vertices[i:i+4]).rect for i in range(0, len(vertices), 4)]
+        return self.get_page_text_layer(page_number).get_text_in_rects(quad_rects)
 
     def remove_annotations(self, page_number, rect):
         annots = self.get_page_pdf_annotations(page_number)
@@ -813,12 +1696,14 @@ class Document:
         
         for annot in annots_to_delete:
             page.delete_annot(annot)
+        self.invalidate_page_annotations(page_number)
         self.save_changes()
 
     def embed_text_in_pdf(self, text, page_number, rect, params):
         pdf_page = self.get_page(page_number)
         annot = pdf_page.add_freetext_annot(rect, text, **params)
         annot.update()
+        self.invalidate_page_annotations(page_number)
         self.save_changes()
 
     def embed_highlight(self, highlight, colormap=None):
@@ -831,66 +1716,224 @@ class Document:
         'custom' uses a custom algorithm based on highlight location to embed the highlights.
         """
 
-        if colormap is None:
-            colormap = COLOR_MAP
+        rects = self.get_highlight_rects(highlight, self.sioyek.highlight_embed_method)
+        self.embed_highlight_rects(highlight, rects, colormap)
 
-        method = self.sioyek.highlight_embed_method
+    def get_highlight_rects(self, highlight, method):
+        '''
+        Returns the rects of the page text that should be highlighted to embed `highlight`, see `embed_highlight`
+        for the description of `method`.
+        '''
         docpos = highlight.get_begin_document_pos()
-        page = self.get_page(docpos.page)
         # quads = page.search_for(highlight.text, flags=fitz.TEXT_PRESERVE_WHITESPACE, hit_max=50)
         if method == 'fitz':
-            quads = self.get_best_selection_rects(docpos.page, highlight.text, merge=True)
+            return self.get_best_selection_rects(docpos.page, highlight.text, merge=True)
         else:
             selection_begin_abs = AbsoluteDocumentPos(highlight.selection_begin[0], highlight.selection_begin[1])
             selection_end_abs = AbsoluteDocumentPos(highlight.selection_end[0], highlight.selection_end[1])
 
             selected_words = self.get_selected_words(selection_begin_abs, selection_end_abs)
             selected_rects = [fitz.Rect(*word[:4]) for word in selected_words[0]]
-            merged_rects = merge_rects(selected_rects)
-            quads = [rect.quad for rect in merged_rects]
+            return merge_rects(selected_rects)
 
-        annot = page.add_highlight_annot(quads)
+    def embed_highlight_rects(self, highlight, rects, colormap=None):
+        if colormap is None:
+            colormap = COLOR_MAP
+
+        page_number = highlight.get_begin_document_pos().page
+        page = self.get_page(page_number)
+        annot = page.add_highlight_annot(rects)
         if colormap is not None:
             if highlight.highlight_type in colormap.keys():
                 color = colormap[highlight.highlight_type]
                 annot.set_colors(stroke=color, fill=color)
                 annot.update()
+        self.invalidate_page_annotations(page_number)
 
     def embed_bookmark(self, bookmark):
         page_number, offset_y = bookmark.get_document_position()
         page = self.get_page(page_number)
         # print((0, offset_y), bookmark.description)
         page.add_text_annot((0, offset_y), bookmark.description)
+        self.invalidate_page_annotations(page_number)
     
-    def embed_new_bookmarks(self):
-        new_bookmarks = self.get_non_embedded_bookmarks()
+    def embed_new_bookmarks(self, after_rowid=None):
+        new_bookmarks = self.get_non_embedded_bookmarks(after_rowid)
         for bookmark in new_bookmarks:
             self.embed_bookmark(bookmark)
     
-    def embed_new_highlights(self, colormap=None):
-        new_highlights = self.get_non_embedded_highlights()
+    def embed_new_highlights(self, colormap=None, after_rowid=None):
+        new_highlights = self.get_non_embedded_highlights(after_rowid)
         for highlight in new_highlights:
             self.embed_highlight(highlight, colormap)
     
-    def embed_new_annotations(self, save=False, colormap=None):
-        self.embed_new_bookmarks()
-        self.embed_new_highlights(colormap=colormap)
+    def embed_new_annotations(self, save=False, colormap=None, workers=None, compact=False, incremental=True):
+        '''
+        Embed the sioyek highlights and bookmarks which are not already in the PDF file. If `workers` is more than one,
+        the pages are processed by a pool of `workers` processes, see `get_non_embedded_highlight_rects_parallel`.
+        See `save_changes` for `compact`. If `incremental` is True, only the database rows which were added since the
+        last embed are checked (as long as neither the file nor the old rows have changed since, see `SyncState`).
+        '''
+        highlight_rowid, bookmark_rowid = self.get_embed_start_rowids() if incremental else (None, None)
+        # read the watermarks before the rows, so that the rows added in between are checked again next time
+        watermarks = self.get_row_watermarks()
+
+        if self.should_use_workers(workers):
+            # the workers read the file from disk, so find the highlights before changing the document
+            new_highlight_rects = self.get_non_embedded_highlight_rects_parallel(workers, highlight_rowid)
+            self.embed_new_bookmarks(bookmark_rowid)
+            for highlight, rects in new_highlight_rects:
+                self.embed_highlight_rects(highlight, rects, colormap)
+        else:
+            self.embed_new_bookmarks(bookmark_rowid)
+            self.embed_new_highlights(colormap=colormap, after_rowid=highlight_rowid)
 
         if save:
-            self.save_changes()
+            self.save_changes(compact=compact)
+            # the save is deferred inside an edit session, in which case we don't know the final file yet
+            if incremental and (not self.has_unsaved_changes):
+                embed_state = dict(watermarks)
+                embed_state['file_stamp'] = list(get_file_stamp(self.path))
+                self.get_sync_state().set('embed', embed_state)
+
+    def get_sync_state(self):
+        return SyncState(self.get_cache_file_path('sync_state'))
+
+    def get_row_watermarks(self):
+        shared_database = self.sioyek.get_shared_database()
+        return {table: database.get_row_watermark(shared_database, table, self.get_hash()) for table in database.WATERMARK_TABLES}
+
+    def are_row_watermarks_valid(self, state):
+        shared_database = self.sioyek.get_shared_database()
+        return all(database.is_row_watermark_valid(shared_database, table, self.get_hash(), state[table]) for table in database.WATERMARK_TABLES)
+
+    def get_embed_start_rowids(self):
+        '''
+        Returns the (highlight, bookmark) rowids after which the database rows may not be embedded yet, or (None, None)
+        if all the rows have to be checked.
+        '''
+        state = self.get_sync_state().get('embed')
+        if state == None or state['file_stamp'] != list(get_file_stamp(self.path)):
+            return None, None
+        if not self.are_row_watermarks_valid(state):
+            return None, None
+        return state['highlights'][0], state['bookmarks'][0]
+
+    def get_page_annots_key(self, page_number):
+        '''
+        The /Annots entry of the page, which changes whenever an annotation is added to or removed from the page.
+        '''
+        value_type, value = self.doc.xref_get_key(self.doc.page_xref(page_number), 'Annots')
+        if value_type == 'xref':
+            # the array is an indirect object, compare its contents instead of the reference
+            return self.doc.xref_object(int(value.split()[0]), compressed=True)
+        return value
+
+    def get_import_page_numbers(self, page_annots_keys):
+        '''
+        Returns the numbers of the pages whose annotations have changed since the last import, or None if all the pages
+        have to be checked.
+        '''
+        state = self.get_sync_state().get('import')
+        if state == None or len(state['page_annots']) != len(page_annots_keys):
+            return None
+        # if sioyek annotations were deleted, the PDF annotations matching them have to be imported again
+        if not self.are_row_watermarks_valid(state):
+            return None
+        return [page_number for page_number, key in enumerate(page_annots_keys) if key != state['page_annots'][page_number]]
 
     
-    def save_changes(self):
-        self.doc.saveIncr()
+    def save_changes(self, compact=False):
+        '''
+        Saves the changes as an incremental revision of the file. If `compact` is True and the file already has
+        `COMPACT_MIN_REVISIONS` revisions, the whole file is rewritten (without the unused objects) instead.
+        Inside an `edit_session` the save is deferred to the end of the session.
+        '''
+        if self.edit_session_depth > 0:
+            self.has_deferred_changes = True
+            return
+
+        if (compact and self.revision_count >= COMPACT_MIN_REVISIONS) or (not self.doc.can_save_incrementally()):
+            self.save_compacted()
+        else:
+            self.doc.saveIncr()
+            self.revision_count += 1
+        self.has_deferred_changes = False
+        self.has_unsaved_changes = False
+
+    def save_compacted(self):
+        temp_path = self.path + '.compact.tmp'
+        try:
+            self.doc.save(temp_path, garbage=3, deflate=True)
+            self.doc.close()
+            os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if self.doc.is_closed:
+                self.reopen()
+
+    def reopen(self):
+        '''
+        Reopens the file, discarding the changes which are not saved.
+        '''
+        self.page_cache.clear()
+        if not self.doc.is_closed:
+            self.doc.close()
+        self.doc = fitz.open(self.path)
+        self.has_unsaved_changes = False
+        self.revision_count = self.doc.version_count
+        self.set_page_dimensions()
+
+    @contextmanager
+    def edit_session(self, compact=False):
+        '''
+        Saves all the changes made in the `with` block (e.g. by `remove_annotations` and `embed_text_in_pdf`) in a
+        single incremental save when the block exits, instead of adding a revision to the file for each change.
+        Sessions can be nested, the changes are saved when the outermost session exits. If any of the blocks raises an
+        exception, all the changes of the outermost session are discarded when it exits, even if an outer block catches
+        the exception (the unsaved changes of the nested sessions can't be told apart). See `save_changes` for `compact`.
+        '''
+        self.edit_session_depth += 1
+        try:
+            yield self
+        except:
+            self.edit_session_failed = True
+            raise
+        finally:
+            self.edit_session_depth -= 1
+            if self.edit_session_depth == 0:
+                self.finish_edit_session(compact)
+
+    def finish_edit_session(self, compact):
+        failed = self.edit_session_failed
+        self.edit_session_failed = False
+        if not self.has_deferred_changes:
+            return
+
+        if failed:
+            self.has_deferred_changes = False
+            self.reopen()
+        else:
+            self.save_changes(compact=compact)
 
     def add_imported_bookmark(self, page, bookmark):
-        document_pos = DocumentPos(page, 0, bookmark.rect.top_left.y)
-        absolute_pos = self.to_absolute(document_pos)
-        # self.to_absolute(bookmark.)
-        new_bookmark = Bookmark(self, bookmark.info['content'], absolute_pos.offset_y)
+        new_bookmark = self.create_imported_bookmark(page, bookmark)
         new_bookmark.insert(self)
 
+    def create_imported_bookmark(self, page, bookmark):
+        return self.create_imported_bookmark_from_data(page, *get_pdf_bookmark_data(bookmark))
+
+    def create_imported_bookmark_from_data(self, page, content, top_y):
+        document_pos = DocumentPos(page, 0, top_y)
+        absolute_pos = self.to_absolute(document_pos)
+        return Bookmark(self, content, absolute_pos.offset_y)
+
     def add_imported_highlight(self, page, begin_pos, end_pos, highlight_text, highlight_type):
+        new_highlight = self.create_imported_highlight(page, begin_pos, end_pos, highlight_text, highlight_type)
+        new_highlight.insert(self)
+
+    def create_imported_highlight(self, page, begin_pos, end_pos, highlight_text, highlight_type):
 
         highlight_text = highlight_text.replace('\n', '')
         begin_document_pos = DocumentPos(page, begin_pos[0], begin_pos[1])
@@ -899,121 +1942,267 @@ class Document:
         begin_abs_pos = self.to_absolute(begin_document_pos)
         end_abs_pos = self.to_absolute(end_document_pos)
 
-        page_width = self.page_widths[page]
-        new_highlight = Highlight(
+        page_width = self.page_geometry.get_page_width(page)
+        return Highlight(
             self,
             highlight_text,
             highlight_type,
             (begin_abs_pos.offset_x - page_width/2, begin_abs_pos.offset_y),
             (end_abs_pos.offset_x - page_width/2, end_abs_pos.offset_y)
         )
-        new_highlight.insert(self)
 
-    def import_annotations(self, colormap=None):
+    def import_annotations(self, colormap=None, dry_run=False, workers=None, incremental=True):
+        '''
+        Import the PDF highlights and bookmarks which are not already in the sioyek database into the database.
+        All the new annotations are written in a single transaction. If `dry_run` is True, we only count the new
+        annotations without writing anything. If `workers` is more than one, the pages are compared by a pool of
+        `workers` processes. If `incremental` is True, only the pages whose annotations have changed since the
+        last import are checked (as long as no sioyek annotation was deleted since, see `SyncState`).
+        Returns an `ImportResult`.
+        '''
         if colormap is None:
             colormap = COLOR_MAP
 
-        new_highlights = self.get_non_sioyek_highlights()
-        new_bookmarks = self.get_non_sioyek_bookmarks()
+        # the rows are keyed by the document hash, which sioyek only knows for the documents it has opened
+        if (not dry_run) and self.get_hash() == None:
+            error = 'Can not import the annotations, open the document in sioyek first'
+            self.sioyek.set_status_string(error)
+            return ImportResult(0, 0, 0, 0, error=error)
+
+        begin_time = time.perf_counter()
+        page_numbers = None
+        if incremental:
+            page_annots_keys = [self.get_page_annots_key(page_number) for page_number in range(self.doc.page_count)]
+            page_numbers = self.get_import_page_numbers(page_annots_keys)
+
+        if self.should_use_workers(workers):
+            new_highlights, new_bookmarks = self.get_non_sioyek_annotation_data_parallel(workers, page_numbers)
+        else:
+            new_highlights = self.get_non_sioyek_highlight_data(page_numbers)
+            new_bookmarks = self.get_non_sioyek_bookmark_data(page_numbers)
 
-        for page, text, hl in new_highlights:
-            color = hl.colors['stroke']
+        imported_highlights = []
+        for page, text, color, vertices in new_highlights:
             if colormap:
                 highlight_type = find_highlight_type_with_color(color, colormap)
             else:
                 highlight_type = 'a'
 
-            begin_rect = hl.vertices[:4]
-            end_rect = hl.vertices[-4:]
+            begin_rect = vertices[:4]
+            end_rect = vertices[-4:]
             begin_pos = (begin_rect[0][0], (begin_rect[0][1] + begin_rect[2][1]) / 2)
             end_pos = (end_rect[1][0], (end_rect[0][1] + end_rect[2][1]) / 2)
-            self.add_imported_highlight(page, begin_pos, end_pos, text, highlight_type)
+            imported_highlights.append(self.create_imported_highlight(page, begin_pos, end_pos, text, highlight_type))
 
-        for page, bm in new_bookmarks:
-            self.add_imported_bookmark(page, bm)
+        imported_bookmarks = [self.create_imported_bookmark_from_data(page, content, top_y) for page, content, top_y in new_bookmarks]
+        diff_seconds = time.perf_counter() - begin_time
+
+        if dry_run:
+            return ImportResult(len(imported_highlights), len(imported_bookmarks), diff_seconds, 0, dry_run=True)
+
+        begin_time = time.perf_counter()
+        document_hash = self.get_hash()
+        with database.write_transaction(self.sioyek.get_shared_database()) as shared_database:
+            database.insert_highlight_rows(shared_database, [hl.get_insert_params(document_hash) for hl in imported_highlights])
+            database.insert_bookmark_rows(shared_database, [bm.get_insert_params(document_hash) for bm in imported_bookmarks])
+        write_seconds = time.perf_counter() - begin_time
+
+        if incremental:
+            import_state = self.get_row_watermarks()
+            import_state['page_annots'] = page_annots_keys
+            self.get_sync_state().set('import', import_state)
 
-        self.sioyek.shared_database.commit()
         self.sioyek.reload()
+        return ImportResult(len(imported_highlights), len(imported_bookmarks), diff_seconds, write_seconds)
 
-    def get_non_sioyek_bookmarks(self):
-        num_pages = len(self.page_heights)
-        sioyek_bookmarks = self.get_bookmarks()
+    def get_non_sioyek_bookmark_data(self, page_numbers=None):
+        '''
+        Returns (page_number, content, top_y) tuples of the PDF bookmarks which are not in sioyek, only in `page_numbers` if given.
+        The data is extracted while the page is loaded, the page cache may free the page (and its annotations) afterwards.
+        '''
+        if page_numbers == None:
+            page_numbers = range(self.doc.page_count)
+        sioyek_bookmarks = self.get_bookmark_set()
         page_sioyek_bookmarks = defaultdict(list)
 
-        for sioyek_bookmark in sioyek_bookmarks:
-            bookmark_page = sioyek_bookmark.get_document_position()[0]
-            page_sioyek_bookmarks[bookmark_page].append(sioyek_bookmark)
+        bookmark_pages = sioyek_bookmarks.get_pages()
+        for sioyek_bookmark, bookmark_page in zip(sioyek_bookmarks, bookmark_pages):
+            page_sioyek_bookmarks[int(bookmark_page)].append(sioyek_bookmark)
 
         new_bookmarks = []
+        for page_number in page_numbers:
+            new_bookmarks.extend((page_number,) + get_pdf_bookmark_data(pdf_bm) for pdf_bm in self.get_page_non_sioyek_bookmarks(page_number, page_sioyek_bookmarks[page_number]))
+        return new_bookmarks
 
-        for page_number in range(num_pages):
-            page = self.get_page(page_number)
-            pdf_bookmarks = self.get_page_pdf_bookmarks(page_number)
-            sioyek_bookmarks = page_sioyek_bookmarks[page_number]
-            for pdf_bm in pdf_bookmarks:
-                found = False
-                for sioyek_bm in sioyek_bookmarks:
-                    if are_bookmarks_same(pdf_bm, sioyek_bm):
-                        found = True
-                        break
-                if not found:
-                    new_bookmarks.append((page_number, pdf_bm))
+    def get_page_non_sioyek_bookmarks(self, page_number, sioyek_bookmarks):
+        '''
+        Returns the PDF bookmarks of the page which are not in `sioyek_bookmarks` (the sioyek bookmarks of the page).
+        '''
+        new_bookmarks = []
+        for pdf_bm in self.get_page_pdf_bookmarks(page_number):
+            found = False
+            for sioyek_bm in sioyek_bookmarks:
+                if are_bookmarks_same(pdf_bm, sioyek_bm):
+                    found = True
+                    break
+            if not found:
+                new_bookmarks.append(pdf_bm)
         return new_bookmarks
 
-    def get_non_sioyek_highlights(self):
-        num_pages = len(self.page_heights)
-        sioyek_highlights = self.get_highlights()
+    def get_non_sioyek_highlight_data(self, page_numbers=None):
+        '''
+        Returns (page_number, text, stroke_color, vertices) tuples of the PDF highlights which are not in sioyek, only in
+        `page_numbers` if given. Like `get_non_sioyek_bookmark_data`, the data is extracted while the page is loaded.
+        '''
+        if page_numbers == None:
+            page_numbers = range(self.doc.page_count)
+        sioyek_highlights = self.get_highlight_set()
         page_sioyek_highlights = defaultdict(list)
+        page_sioyek_highlight_offsets = defaultdict(list)
 
-        for sioyek_highlight in sioyek_highlights:
-            highlight_page = sioyek_highlight.get_begin_document_pos().page
-            page_sioyek_highlights[highlight_page].append(sioyek_highlight)
+        highlight_pages, highlight_offsets = self.absolute_to_document_y_batch(sioyek_highlights.begin_y)
+        for sioyek_highlight, highlight_page, highlight_offset in zip(sioyek_highlights, highlight_pages, highlight_offsets):
+            page_sioyek_highlights[int(highlight_page)].append(sioyek_highlight)
+            page_sioyek_highlight_offsets[int(highlight_page)].append(float(highlight_offset))
 
         new_highlights = []
 
-        for page_number in range(num_pages):
-            page = self.get_page(page_number)
-            pdf_highlights = self.get_page_pdf_highlights(page_number)
-            sioyek_highlights = page_sioyek_highlights[page_number]
-            for pdf_hl in pdf_highlights:
-                pdf_highlight_text = get_pdf_highlight_text(pdf_hl, page)
-                found = False
-                for sioyek_hl in sioyek_highlights:
-                    if are_highlights_same(pdf_hl, sioyek_hl, pdf_highlight_text):
-                        found = True
-                        break
-                if not found:
-                    new_highlights.append((page_number, pdf_highlight_text, pdf_hl))
+        for page_number in page_numbers:
+            sioyek_highlight_texts = [highlight.text for highlight in page_sioyek_highlights[page_number]]
+            for pdf_hl, pdf_highlight_text in self.get_page_non_sioyek_highlights(page_number, sioyek_highlight_texts, page_sioyek_highlight_offsets[page_number]):
+                new_highlights.append((page_number, pdf_highlight_text) + get_pdf_highlight_data(pdf_hl))
         return new_highlights
 
+    def get_page_non_sioyek_highlights(self, page_number, sioyek_highlight_texts, sioyek_highlight_offsets):
+        '''
+        Returns the (highlight, highlight_text) pairs of the PDF highlights of the page which don't match any of the
+        sioyek highlights of the page, given as their texts and their y offsets in the page.
+        '''
+        pdf_highlight_index = self.get_page_pdf_highlight_index(page_number)
+        sioyek_highlight_index = VerticalIndex(sioyek_highlight_texts, sioyek_highlight_offsets)
+        new_highlights = []
+        for pdf_hl, pdf_highlight_text in pdf_highlight_index.items:
+            candidates = sioyek_highlight_index.query(pdf_hl.rect[1], SAME_ANNOTATION_MAX_DISTANCE)
+            found = any(are_texts_close(pdf_highlight_text, candidates, FUZZY_TEXT_MAX_ERROR_RATIO))
+            if not found:
+                new_highlights.append((pdf_hl, pdf_highlight_text))
+        return new_highlights
 
-    def get_non_embedded_highlights(self):
+    def get_non_sioyek_annotation_data_parallel(self, workers, page_numbers=None):
+        '''
+        Parallel version of `get_non_sioyek_highlight_data` and `get_non_sioyek_bookmark_data`, returns the
+        (page, text, stroke_color, vertices) tuples of the new highlights and (page, content, top_y) tuples of the new bookmarks.
+        '''
+        sioyek_highlights = self.get_highlight_set()
+        sioyek_bookmarks = self.get_bookmark_set()
+        page_highlight_texts = defaultdict(list)
+        page_highlight_offsets = defaultdict(list)
+        page_bookmarks = defaultdict(list)
+
+        highlight_pages, highlight_offsets = self.absolute_to_document_y_batch(sioyek_highlights.begin_y)
+        for text, highlight_page, highlight_offset in zip(sioyek_highlights.texts, highlight_pages, highlight_offsets):
+            page_highlight_texts[int(highlight_page)].append(text)
+            page_highlight_offsets[int(highlight_page)].append(float(highlight_offset))
+
+        for description, offset_y, bookmark_page in zip(sioyek_bookmarks.descriptions, sioyek_bookmarks.offset_y, sioyek_bookmarks.get_pages()):
+            page_bookmarks[int(bookmark_page)].append((description, float(offset_y)))
+
+        if page_numbers == None:
+            page_numbers = range(self.doc.page_count)
+        page_numbers = list(page_numbers)
+        new_highlights = []
+        new_bookmarks = []
+        with self.create_worker_pool(workers) as executor:
+            page_results = executor.map(
+                find_non_sioyek_annotation_data_in_worker,
+                page_numbers,
+                [page_highlight_texts[page_number] for page_number in page_numbers],
+                [page_highlight_offsets[page_number] for page_number in page_numbers],
+                [page_bookmarks[page_number] for page_number in page_numbers],
+                chunksize=get_worker_chunk_size(len(page_numbers), workers))
+
+            for page_number, (page_new_highlights, page_new_bookmarks) in zip(page_numbers, page_results):
+                new_highlights.extend((page_number,) + highlight_data for highlight_data in page_new_highlights)
+                new_bookmarks.extend((page_number,) + bookmark_data for bookmark_data in page_new_bookmarks)
+        return new_highlights, new_bookmarks
+
+
+    def get_non_embedded_highlights(self, after_rowid=None):
 
-        candidate_highlights = self.get_highlights()
+        candidate_highlights = self.get_highlight_set(after_rowid)
+        candidate_pages, candidate_offsets = self.absolute_to_document_y_batch(candidate_highlights.begin_y)
         new_highlights = []
 
-        for highlight in candidate_highlights:
-            highlight_document_pos = highlight.get_begin_document_pos()
-            pdf_page_highlights = self.get_page_pdf_highlights(highlight_document_pos.page)
-            document_page = self.get_page(highlight_document_pos.page)
-            found = False
-            for pdf_highlight in pdf_page_highlights:
-                #todo: swap the order of for loops so we don't compute highlight_text every iteration
-                highlight_text = get_pdf_highlight_text(pdf_highlight, document_page)
-                if are_highlights_same(pdf_highlight, highlight, highlight_text):
-                    found = True
-                    break
-            if not found:
+        for highlight, highlight_page, highlight_offset in zip(candidate_highlights, candidate_pages, candidate_offsets):
+            if not self.is_highlight_embedded(int(highlight_page), highlight.text, float(highlight_offset)):
                 new_highlights.append(highlight)
         return new_highlights
 
-    def get_non_embedded_bookmarks(self):
+    def is_highlight_embedded(self, page_number, highlight_text, offset_y):
+        pdf_highlight_index = self.get_page_pdf_highlight_index(page_number)
+        for pdf_highlight, pdf_highlight_text in pdf_highlight_index.query(offset_y, SAME_ANNOTATION_MAX_DISTANCE):
+            if is_text_close_fuzzy(pdf_highlight_text, highlight_text):
+                return True
+        return False
 
-        candidate_bookmarks = self.get_bookmarks()
+    def get_page_new_highlight_rects(self, page_number, highlight_rows, offsets_y, method):
+        '''
+        `highlight_rows` are (index, text, type, selection_begin, selection_end) tuples of the sioyek highlights which begin
+        in the page at `offsets_y`. Returns (index, rects) pairs of the highlights which are not embedded in the page,
+        where `rects` is a list of (x0, y0, x1, y1) tuples to highlight (or None if the text was not found).
+        '''
+        res = []
+        for (index, text, highlight_type, begin, end), offset_y in zip(highlight_rows, offsets_y):
+            if self.is_highlight_embedded(page_number, text, offset_y):
+                continue
+            rects = self.get_highlight_rects(Highlight(self, text, highlight_type, begin, end), method)
+            res.append((index, None if rects == None else [tuple(rect) for rect in rects]))
+        return res
+
+    def get_non_embedded_highlight_rects_parallel(self, workers, after_rowid=None):
+        '''
+        Returns (highlight, rects) pairs of the highlights which are not embedded in the PDF file. The pages are processed
+        by a pool of `workers` processes which open the PDF file themselves, so the document should not have unsaved changes.
+        '''
+        candidate_highlights = self.get_highlight_set(after_rowid)
+        candidate_pages, candidate_offsets = self.absolute_to_document_y_batch(candidate_highlights.begin_y)
+        page_rows = defaultdict(list)
+        page_offsets = defaultdict(list)
+        for index, (highlight, highlight_page, highlight_offset) in enumerate(zip(candidate_highlights, candidate_pages, candidate_offsets)):
+            page_rows[int(highlight_page)].append((index, highlight.text, highlight.highlight_type, highlight.selection_begin, highlight.selection_end))
+            page_offsets[int(highlight_page)].append(float(highlight_offset))
+
+        page_numbers = list(page_rows.keys())
+        results = []
+        with self.create_worker_pool(workers) as executor:
+            page_results = executor.map(
+                find_new_highlight_rects_in_worker,
+                page_numbers,
+                [page_rows[page_number] for page_number in page_numbers],
+                [page_offsets[page_number] for page_number in page_numbers],
+                repeat(self.sioyek.highlight_embed_method),
+                chunksize=get_worker_chunk_size(len(page_numbers), workers))
+            for page_result in page_results:
+                results.extend(page_result)
+
+        # embed in the same order as the serial version
+        results.sort(key=lambda result: result[0])
+        return [(candidate_highlights[index], None if rects == None else [fitz.Rect(rect) for rect in rects]) for index, rects in results]
+
+    def should_use_workers(self, workers):
+        # the workers can't see the changes that are not saved to the file
+        return workers != None and workers > 1 and (not self.has_unsaved_changes)
+
+    def create_worker_pool(self, workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=open_worker_document, initargs=(self.path,))
+
+    def get_non_embedded_bookmarks(self, after_rowid=None):
+
+        candidate_bookmarks = self.get_bookmark_set(after_rowid)
         new_bookmarks = []
 
-        for bookmark in candidate_bookmarks:
-            pdf_page_bookmarks = self.get_page_pdf_bookmarks(bookmark.get_document_position()[0])
+        for bookmark, bookmark_page in zip(candidate_bookmarks, candidate_bookmarks.get_pages()):
+            pdf_page_bookmarks = self.get_page_pdf_bookmarks(int(bookmark_page))
             found = False
             for pdf_bookmark in pdf_page_bookmarks:
                 if bookmark.description == pdf_bookmark.info['content']:
@@ -1023,67 +2212,54 @@ class Document:
                 new_bookmarks.append(bookmark)
         return new_bookmarks
             
-    def get_page_text_and_rects(self, page_number):
-        page = self.get_page(page_number)
-        word_data = page.get_text('words')
+    def get_page_text_layer(self, page_number):
+        return self.page_cache.get(page_number, 'text_layer', lambda: PageTextLayer(self.get_page(page_number).get_text('words')))
 
-        word_texts = []
-        word_rects = []
-        resulting_string = ""
-        string_rects = []
+    def get_page_word_index(self, page_number):
+        text_layer = self.get_page_text_layer(page_number)
+        return self.page_cache.get(page_number, 'word_index', lambda: WordIndex([word[:4] for word in text_layer.word_data]))
 
-        for i in range(len(word_data)):
-            word_text = word_data[i][4]
-            block_no = word_data[i][5]
-            line_no = word_data[i][6]
-            if i > 0:
-                if block_no != word_data[i-1][5]:
-                    word_text = word_text + '\n'
-            word_texts.append(word_text)
-            word_rects.append(fitz.Rect(word_data[i][0:4]))
+    def get_page_text_and_rects(self, page_number):
+        text_layer = self.get_page_text_layer(page_number)
+        word_rects = text_layer.get_word_rects(range(len(text_layer.word_texts)))
+        string_rects = [word_rects[word_index] for word_index in text_layer.char_to_word]
+        return text_layer.text, string_rects, list(text_layer.word_texts), word_rects
 
-            additional_string = word_text
+    def set_page_dimensions(self):
+        self.page_geometry = PageGeometry(self.doc, self.get_page_geometry_cache_file_path, get_file_stamp(self.path))
 
-            if word_text[-1] != '\n':
-                additional_string += ' '
-            
-            resulting_string += additional_string
-            string_rects.extend([fitz.Rect(word_data[i][0:4])] * len(additional_string))
-        
-        return resulting_string, string_rects, word_texts, word_rects
+    def get_page_geometry_cache_file_path(self):
+        return self.get_cache_file_path('page_geometry')
 
-    def set_page_dimensions(self):
-        self.page_heights = []
-        self.page_widths = []
-        self.cum_page_heights = []
+    def get_cache_file_path(self, cache_name):
+        '''
+        Path of the JSON file of this document in the `cache_name` cache, None if the cache can't be used.
+        '''
+        if self.sioyek == None or self.sioyek.get_local_database() == None:
+            return None
 
-        cum_height = 0
-        for i in range(self.doc.page_count):
-            page = self.doc.load_page(i)
-            # can't simply use the page's mediabox because some documents have non-zero origin
-            # see https://github.com/ahrm/sioyek-python-extensions/issues/2#issuecomment-1578255778 
-            # width, height = page.mediabox_size
-            cropbox = page.cropbox
-            width = cropbox[2] - cropbox[0]
-            height = cropbox[3] - cropbox[1]
-
-            self.page_heights.append(height)
-            self.page_widths.append(width)
-            self.cum_page_heights.append(cum_height)
-            cum_height += height
+        cache_path = self.sioyek.get_cache_path()
+        if cache_path == None:
+            return None
+
+        document_hash = self.get_hash()
+        if document_hash == None:
+            return None
+        return os.path.join(cache_path, cache_name, document_hash + '.json')
     
     def get_best_selection_rects(self, page_number, text, merge=False):
-        for i in range(10):
-            rects = self.get_text_selection_rects(page_number, text, num_errors=i)
+        # first try an exact search and then find the best approximate match in a single pass
+        for num_errors in [0, MAX_SELECTION_ERRORS]:
+            rects = self.get_text_selection_rects(page_number, text, num_errors=num_errors)
             if len(rects) > 0:
-                if i > 0 and merge == True:
+                if num_errors > 0 and merge == True:
                     rects = merge_rects(rects)
                 return rects
         return None
 
     def get_best_selection(self, page_number, text):
-        for i in range(10):
-            res = self.get_text_selection_begin_and_end(page_number, text, num_errors=i)
+        for num_errors in [0, MAX_SELECTION_ERRORS]:
+            res = self.get_text_selection_begin_and_end(page_number, text, num_errors=num_errors)
             if res[0][0] != None:
                 return res
         return None
@@ -1094,14 +2270,13 @@ class Document:
             rects = page.search_for(text)
             return rects
         else:
-            page_text, page_rects, _, _ = self.get_page_text_and_rects(page_number)
-            match = regex.search('(' + regex.escape(text) + '){e<=' + str(num_errors) +'}', page_text)
+            text_layer = self.get_page_text_layer(page_number)
+            match = find_best_match(text, text_layer.text, max_errors=num_errors)
             if match:
-                match_begin, match_end = match.span()
+                match_begin, match_end, _ = match
                 # print('match: ')
-                # print(page_text[match_begin + 1: match_end+1])
-                rects = page_rects[match_begin + 1: match_end+1]
-                return list(dict.fromkeys(rects))
+                # print(text_layer.text[match_begin + 1: match_end+1])
+                return text_layer.get_span_rects(match_begin + 1, match_end + 1)
             else:
                 return []
 
@@ -1142,49 +2317,31 @@ class Document:
         return res
     
     def get_hash(self):
-        path_hash_map = self.sioyek.get_path_hash_map()
-
-        for path, hash_ in path_hash_map.items():
-            if os.path.normpath(self.path) == os.path.normpath(path):
-                self.cached_hash = hash_
+        if self.cached_hash == None:
+            self.cached_hash = self.sioyek.get_document_hash(self.path)
         return self.cached_hash
     
     def get_bookmarks(self):
-        doc_hash = self.get_hash()
-        BOOKMARK_SELECT_QUERY = "select * from bookmarks where document_path='{}'".format(doc_hash)
-        shared_database = self.sioyek.get_shared_database()
-        cursor = shared_database.execute(BOOKMARK_SELECT_QUERY)
-        bookmarks = [Bookmark(self, desc, y_offset) for _, _, desc, y_offset in cursor.fetchall()]
-        return bookmarks
+        return list(self.get_bookmark_set())
+
+    def get_bookmark_set(self, after_rowid=None):
+        document_hash = self.get_hash()
+        rows = database.get_bookmark_rows(self.sioyek.get_shared_database(), document_hash, after_rowid)
+        return BookmarkSet.from_rows(((document_hash, desc, y_offset) for desc, y_offset in rows), document=self)
 
     def get_highlights(self):
-        doc_hash = self.get_hash()
-        HIGHLIGHT_SELECT_QUERY = "select * from highlights where document_path='{}'".format(doc_hash)
+        return list(self.get_highlight_set())
 
-        shared_database = self.sioyek.get_shared_database()
-        cursor = shared_database.execute(HIGHLIGHT_SELECT_QUERY)
-        highlights = [Highlight(self, text, highlight_type, (begin_x, begin_y), (end_x, end_y)) for _, _, text, highlight_type, begin_x, begin_y, end_x, end_y in cursor.fetchall()]
-        return highlights
+    def get_highlight_set(self, after_rowid=None):
+        document_hash = self.get_hash()
+        rows = database.get_highlight_rows(self.sioyek.get_shared_database(), document_hash, after_rowid)
+        return HighlightSet.from_rows(((document_hash,) + row for row in rows), document=self)
     
     def get_page_selection(self, page_number, selection_begin_x, selection_begin_y, selection_end_x, selection_end_y):
-        in_range = False
-        page = self.get_page(page_number)
-        words = page.get_text_words()
-
-        selected_words = []
-        word_rects = [fitz.Rect(*word[:4]) for word in words]
-        start_closest_rect = get_closest_rect_to_point(word_rects, (selection_begin_x, selection_begin_y))
-        end_closest_rect = get_closest_rect_to_point(word_rects, (selection_end_x, selection_end_y))
-
-        for word_item, word_rect in zip(words, word_rects):
-            if start_closest_rect == word_rect:
-                in_range = True
-            if in_range:
-                selected_words.append(word_item)
-            if end_closest_rect == word_rect:
-                in_range = False
-
-        return selected_words, page_number
+        words = self.get_page_text_layer(page_number).word_data
+        word_index = self.get_page_word_index(page_number)
+        selected_range = word_index.get_selection((selection_begin_x, selection_begin_y), (selection_end_x, selection_end_y))
+        return [words[i] for i in selected_range], page_number
 
     def get_selected_words(self, selection_begin, selection_end):
 
@@ -1205,5 +2362,66 @@ class Document:
         word_bounding_boxes = [fitz.Rect(*x[:4]) for x in words]
         highlight_bounding_box = get_bounding_box(word_bounding_boxes)
         return highlight_bounding_box, page_number
+
+    def get_highlight_bounding_boxes(self, highlights):
+        '''
+        Batch version of `get_highlight_bounding_box`, returns the (bounding_box, page_number) of each highlight.
+        The highlights are processed page by page, so the words of each page are extracted (and indexed) once
+        even if the page cache can't hold all the pages.
+        '''
+        results = [(fitz.Rect(0, 0, 0, 0), -1)] * len(highlights)
+        selections = dict()
+        highlights_by_page = defaultdict(list)
+        for i, highlight in enumerate(highlights):
+            selection_begin_doc = self.to_document(highlight.get_begin_abs_pos(), pypdf=True)
+            selection_end_doc = self.to_document(highlight.get_end_abs_pos(), pypdf=True)
+            if selection_begin_doc.page == selection_end_doc.page:
+                selections[i] = (selection_begin_doc.offset_x, selection_begin_doc.offset_y), (selection_end_doc.offset_x, selection_end_doc.offset_y)
+                highlights_by_page[selection_begin_doc.page].append(i)
+
+        for page_number in sorted(highlights_by_page.keys()):
+            words = self.get_page_text_layer(page_number).word_data
+            word_index = self.get_page_word_index(page_number)
+            for i in highlights_by_page[page_number]:
+                selected_range = word_index.get_selection(*selections[i])
+                results[i] = (get_bounding_box([words[j][:4] for j in selected_range]), page_number)
+        return results
+
     def close(self):
+        self.page_cache.clear()
         self.doc.close()
+
+def get_pdf_highlight_data(pdf_highlight):
+    '''
+    Returns the (stroke_color, vertices) of the highlight annotation as plain (picklable) data.
+    '''
+    return tuple(pdf_highlight.colors['stroke']), [tuple(vertex) for vertex in pdf_highlight.vertices]
+
+def get_pdf_bookmark_data(pdf_bookmark):
+    '''
+    Returns the (content, top_y) of the bookmark annotation as plain (picklable) data.
+    '''
+    return pdf_bookmark.info['content'], pdf_bookmark.rect.top_left.y
+
+def get_worker_chunk_size(num_tasks, workers):
+    # a few chunks per worker, so that the pages with many annotations are spread between the workers
+    return max(1, num_tasks // (workers * 4))
+
+# the document opened by each worker process of `Document.create_worker_pool`
+worker_document = None
+
+def open_worker_document(path):
+    global worker_document
+    worker_document = Document(path, None)
+
+def find_new_highlight_rects_in_worker(page_number, highlight_rows, offsets_y, method):
+    return worker_document.get_page_new_highlight_rects(page_number, highlight_rows, offsets_y, method)
+
+def find_non_sioyek_annotation_data_in_worker(page_number, sioyek_highlight_texts, sioyek_highlight_offsets, sioyek_bookmark_rows):
+    sioyek_bookmarks = [Bookmark(worker_document, description, offset_y) for description, offset_y in sioyek_bookmark_rows]
+    new_highlights = worker_document.get_page_non_sioyek_highlights(page_number, sioyek_highlight_texts, sioyek_highlight_offsets)
+    new_bookmarks = worker_document.get_page_non_sioyek_bookmarks(page_number, sioyek_bookmarks)
+    return (
+        [(text,) + get_pdf_highlight_data(pdf_highlight) for pdf_highlight, text in new_highlights],
+        [get_pdf_bookmark_data(pdf_bookmark) for pdf_bookmark in new_bookmarks]
+    )
@@ -3,10 +3,13 @@ from googletrans import Translator
 
 from .sioyek import Sioyek, clean_path
 
-if __name__ == '__main__':
-    sioyek_path = clean_path(sys.argv[1])
-    text = sys.argv[2]
-    sioyek = Sioyek(sioyek_path)
+def main(argv, sioyek_factory=Sioyek):
+    sioyek_path = clean_path(argv[1])
+    text = argv[2]
+    sioyek = sioyek_factory(sioyek_path)
     translator = Translator()
     translation = translator.translate(text, dest='en')
-    sioyek.set_status_string(translation.text)
\ No newline at end of file
+    sioyek.set_status_string(translation.text)
+
+if __name__ == '__main__':
+    main(sys.argv)